@@ -1,111 +1,270 @@
+import asyncio
+import hashlib
+import json
 import logging
+import pathlib
 import re
+import time
+import typing
 
-from . import global_instance, SessionManager
-from bs4 import BeautifulSoup
-import js2py
+from . import get_global_instance, SessionManager
+from .jsobject import iter_exports
+
+
+_script_open = re.compile(r"<script\b[^>]*>", re.I)
+_script_close = re.compile(r"</script\s*>", re.I)
+_endpoints = re.compile("endpoints", re.I)
+_endpoints_script = re.compile(r"endpoints\.", re.I)
+_route_pair = re.compile('"(.*?)":"(.*?)"')
+_api_pair = re.compile(',(.*?):"(.*?)"')
+_asset_root = re.compile('"https://abs.twimg.com/(.*?)/"')
+
+
+class ScriptScanner:
+    # Enough of a tail to hold a "</script>" split across chunks.
+    overlap = 256
+
+    def __init__(self, wanted: typing.Pattern = None):
+        """
+        Pulls <script> bodies out of html as it streams in, without building a document tree.
+
+        :param wanted: Only keep scripts whose body matches this pattern. Keeps everything if None.
+        """
+        self.wanted = wanted
+        self._buffer = ""
+        self._inside = False
+        # How far into a script body we've already looked for </script>.
+        self._scanned = 0
+
+    def feed(self, chunk: str) -> typing.List[str]:
+        """
+        :param chunk: The next piece of html.
+        :return: The script bodies completed by this chunk.
+        """
+        self._buffer += chunk
+        scripts = []
+        while True:
+            if not self._inside:
+                match = _script_open.search(self._buffer)
+                if not match:
+                    # Keep a tag that hasn't closed yet, however long it is. It may be a <script> cut in half.
+                    tag = self._buffer.rfind("<")
+                    if tag == -1 or ">" in self._buffer[tag:]:
+                        self._buffer = ""
+                    else:
+                        self._buffer = self._buffer[tag:]
+                    return scripts
+                self._buffer = self._buffer[match.end() :]
+                self._inside = True
+                self._scanned = 0
+            match = _script_close.search(self._buffer, self._scanned)
+            if not match:
+                self._scanned = max(0, len(self._buffer) - self.overlap)
+                return scripts
+            body = self._buffer[: match.start()]
+            self._buffer = self._buffer[match.end() :]
+            self._inside = False
+            if self.wanted is None or self.wanted.search(body):
+                scripts.append(body)
+
+
+class RouteCache:
+    def __init__(
+        self, cacheFolder: pathlib.Path = pathlib.Path.home(), ttl: float = 21600
+    ):
+        """
+        Keeps the last discovered routes on disk, next to the guest token cache.
+
+        :param cacheFolder: The folder where ".redgalaxy/routes.json" is kept.
+        :param ttl: How long cached routes are trusted without checking twitter's homepage, in seconds.
+        """
+        self.cacheFile = cacheFolder.resolve() / ".redgalaxy" / "routes.json"
+        self.ttl = ttl
+
+    def read(self) -> typing.Optional[dict]:
+        """
+        :return: The cached {"key", "st", "routes"} dict or None if missing or unreadable.
+        """
+        if not self.cacheFile.exists():
+            return None
+        try:
+            cached = json.loads(self.cacheFile.read_text(encoding="utf-8"))
+        except ValueError:
+            return None
+        if not cached.get("routes"):
+            return None
+        return cached
+
+    def fresh(self, cached: dict) -> bool:
+        return cached.get("st", 0) > time.time() - self.ttl
+
+    def write(self, key: str, routes: dict):
+        self.cacheFile.parent.mkdir(parents=True, exist_ok=True)
+        self.cacheFile.write_text(
+            json.dumps({"key": key, "st": time.time(), "routes": routes})
+        )
+
+    def touch(self, cached: dict):
+        """
+        Marks cached routes as validated without rewriting them.
+        """
+        self.write(cached["key"], cached["routes"])
 
 
 class HighGravity:
     magic = "a"
+    root = "https://abs.twimg.com/"
 
-    def __init__(self, sessionInstance: SessionManager = None):
+    def __init__(
+        self,
+        sessionInstance: SessionManager = None,
+        routeCache: RouteCache = None,
+        concurrency: int = 8,
+    ):
         """
         HighGravity loads twitter's JS files and extracts graphql routes to ensure
         that the routeIds used are up-to-date for the routes required by the rest of the
         other params.
         :param sessionInstance: A SessionManager instance. If none is provided, it uses the global instance version.
+        :param routeCache: A RouteCache instance. If none is provided, routes are cached in the home folder.
+        :param concurrency: The max number of bundles fetched at the same time.
         """
         if sessionInstance is None:
-            sessionInstance = global_instance
+            sessionInstance = get_global_instance()
         self.session = sessionInstance
+        self.routeCache = RouteCache() if routeCache is None else routeCache
+        self.concurrency = concurrency
         self.logging = logging.getLogger("HighGravity")
 
-    async def retrieve_routes(self):
+    async def retrieve_routes(self, force: bool = False, revalidate: bool = False):
         """
         Requests and retireves the routes.
+        Cached routes are used as-is within the cache's ttl. After that, they are reused
+        if twitter's homepage still points at the same bundles.
+        :param force: Ignore the cache and always scrape the bundles.
+        :param revalidate: Always check the homepage, even if the cache is within its ttl.
         :return: A dictionary mapped by the route names.
         """
-        r = await self.session.get("https://twitter.com", set_auth=False)
-        if r.status_code != 200:
-            self.logging.error(r.text)
-            self.logging.error(
-                f"Failed to get routes. Expected 200. Got: {r.status_code}"
-            )
+        cached = None if force else self.routeCache.read()
+        if cached and not revalidate and self.routeCache.fresh(cached):
+            self.logging.debug("Using cached routes.")
+            return cached["routes"]
+
+        bundles = await self.retrieve_bundles()
+        if bundles is None:
             return {}
-        self.logging.debug("Content found.")
+        key = self.bundle_key(bundles)
+        if cached and cached.get("key") == key:
+            self.logging.debug("Bundles unchanged. Revalidated cached routes.")
+            self.routeCache.touch(cached)
+            return cached["routes"]
+
+        # Fetch every bundle at once, but merge in the order the homepage lists them
+        # so later bundles still win the same way they did when fetched one by one.
+        limit = asyncio.Semaphore(self.concurrency)
+
+        async def fetch(bundle):
+            async with limit:
+                return await self.process_js(self.root, *bundle)
 
-        soup = BeautifulSoup(r.text, "lxml")
-        r = re.compile('"(.*?)":"(.*?)"')
-        ra = re.compile(',(.*?):"(.*?)"')
-        r2 = re.compile('"https://abs.twimg.com/(.*?)/"')
-        rba_f = None
         routes = {}
-        c = 0
-        for script in soup.select("script"):
-            if "endpoints.".lower() in script.text.lower():
-                self.logging.debug("endpoints. found.")
-                rba = r2.findall(script.text)
-                if len(rba) == 1:
-                    rba_f = rba[0]
-                    self.logging.debug(f"rba_f Found: {rba_f}")
-                rb = r.findall(script.text)
-                rab = ra.findall(script.text)
-                for i in rab:
-                    if i[0] == "api" and len(i[1]) == 7:
-                        self.logging.debug(f"Regex Matched: {i[0]} {i[1]}")
-                        ra = await self.process_js(
-                            "https://abs.twimg.com/", rba_f, i[0], i[1]
-                        )
-                        if ra is None:
-                            continue
-                        for route_key, route_data in ra.items():
-                            routes[route_key] = route_data
-                for match in rb:
-                    java, hash_ver = match
-                    if "endpoints" in java.lower():
-                        # print(match)
-                        if rba_f is None:
-                            continue
-                        self.logging.debug(f"Regex Matched: {match[0]} {match[1]}")
-                        ra = await self.process_js(
-                            "https://abs.twimg.com/", rba_f, match[0], match[1]
-                        )
-                        if ra is None:
-                            continue
-                        for route_key, route_data in ra.items():
-                            routes[route_key] = route_data
-                # print(rb)
+        for ra in await asyncio.gather(*[fetch(bundle) for bundle in bundles]):
+            if ra is None:
+                continue
+            for route_key, route_data in ra.items():
+                routes[route_key] = route_data
+        if routes:
+            self.routeCache.write(key, routes)
         return routes
 
+    @staticmethod
+    def bundle_key(bundles: typing.List[typing.Tuple[str, str, str]]) -> str:
+        """
+        Hashes the bundle names and versions the homepage points to.
+        Twitter changes these whenever it deploys, so it's a cheap way to tell if routes are stale.
+        """
+        joined = "\n".join("/".join(bundle) for bundle in bundles)
+        return hashlib.sha1(joined.encode()).hexdigest()
+
+    async def retrieve_bundles(
+        self,
+    ) -> typing.Optional[typing.List[typing.Tuple[str, str, str]]]:
+        """
+        Requests twitter's homepage and finds the endpoint bundles it loads.
+        :return: A list of (mode, route, hash) for every bundle worth processing, or None if the homepage failed.
+        """
+        scripts = []
+        async with self.session.stream(
+            "GET", "https://twitter.com", set_auth=False
+        ) as r:
+            if r.status_code != 200:
+                await r.aread()
+                self.logging.error(r.text)
+                self.logging.error(
+                    f"Failed to get routes. Expected 200. Got: {r.status_code}"
+                )
+                return None
+            self.logging.debug("Content found.")
+            # Only the scripts that mention endpoints are kept. The rest of the page is dropped as it streams.
+            scanner = ScriptScanner(_endpoints_script)
+            async for chunk in r.aiter_text():
+                scripts.extend(scanner.feed(chunk))
+
+        rba_f = None
+        bundles = []
+        for script in scripts:
+            self.logging.debug("endpoints. found.")
+            rba = _asset_root.findall(script)
+            if len(rba) == 1:
+                rba_f = rba[0]
+                self.logging.debug(f"rba_f Found: {rba_f}")
+            if rba_f is None:
+                continue
+            for i in _api_pair.findall(script):
+                if i[0] == "api" and len(i[1]) == 7:
+                    self.logging.debug(f"Regex Matched: {i[0]} {i[1]}")
+                    bundles.append((rba_f, i[0], i[1]))
+            for java, hash_ver in _route_pair.findall(script):
+                if _endpoints.search(java):
+                    self.logging.debug(f"Regex Matched: {java} {hash_ver}")
+                    bundles.append((rba_f, java, hash_ver))
+        # The same bundle can show up in more than one script.
+        return [
+            bundle for bundle in dict.fromkeys(bundles) if self.wanted(bundle[1])
+        ]
+
     filtered = ["AudioSpaces", "UsersGraphQL", "api"]
 
+    def wanted(self, route):
+        for filt in self.filtered:
+            if route.endswith(filt):
+                return True
+        return False
+
     async def process_js(self, root, mode, route, hash):
-        process = False
         js_url = f"{root}{mode}/{route}.{hash}{self.magic}.js"
         self.logging.debug(f"Processing JS: {js_url}")
         # print(js_url)
-        for filt in self.filtered:
-            if route.endswith(filt):
-                process = True
-                break
-        if not process:
+        if not self.wanted(route):
             return
         self.logging.debug(f"Retrieving JS content: {js_url}")
         j = await self.session.get(js_url)
         if j.status_code == 200:
-            js = j.text
-            reg = re.compile("({)e\.exports=({+.+?}+)")  # Bit cursed but eh.
-            routes = [f"{a}{b}" for a, b in reg.findall(js)]
-            final_routes = {}
-            for route in routes:
-                # print(route[1:-1])
-                c = js2py.eval_js(f"route = {route[1:-1]}")
-                # print(type(c), c)
-                if isinstance(c, js2py.base.JsObjectWrapper):
-                    url = f"https://api.twitter.com/graphql/{c['queryId']}/{c['operationName']}"
-                    features = c["metadata"]
-                    final_routes[c["operationName"]] = [url, features]
-                else:
-                    raise Exception(f"Export string changed or invalid?")
-            return final_routes
+            return self.extract_routes(j.text)
+
+    @staticmethod
+    def extract_routes(js: str) -> dict:
+        """
+        Pulls the graphql routes out of an endpoint bundle.
+        :param js: The bundle's source.
+        :return: A dictionary of operationName to [url, metadata].
+        """
+        final_routes = {}
+        for c in iter_exports(js):
+            if "queryId" not in c or "operationName" not in c:
+                # Not a graphql route. Bundles export other things too.
+                continue
+            url = f"https://api.twitter.com/graphql/{c['queryId']}/{c['operationName']}"
+            features = c.get("metadata", {})
+            final_routes[c["operationName"]] = [url, features]
+        return final_routes
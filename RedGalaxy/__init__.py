@@ -1,8 +1,25 @@
 from .exceptions import *
-from .session import global_instance, SessionManager, SessionMode
-from .HighGravity import HighGravity
+from .session import SessionManager, SessionMode, get_global_instance
+from .ratelimit import RateLimiter
+from .cache import ResponseCache
+from .routes import RouteRegistry
+from .HighGravity import HighGravity, RouteCache
 from .models import *
 from .utils import UtilBox
+from .dedupe import Deduper, SeenSet, SnowflakeWindowSet, RotatingBloomFilter
+from .checkpoint import (
+    Checkpoint,
+    CheckpointStore,
+    FileCheckpointStore,
+    SQLiteCheckpointStore,
+)
 from .user import TwitterUser
-from .search import TwitterSearch
+from .search import TwitterSearch, Watermark, PageSize
 from .xAuth import xAuth
+
+
+def __getattr__(name):
+    # global_instance is created lazily. See session.get_global_instance.
+    if name == "global_instance":
+        return get_global_instance()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,266 @@
+import collections
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import time
+import typing
+
+import httpx
+
+from .routes import frozen_digest
+
+# How long responses are kept per route, in seconds. Routes not listed use the cache's default ttl.
+ROUTE_TTLS = {
+    "SearchTimeline": 60,
+    "TweetDetail": 300,
+    "UserByScreenName": 3600,
+    "UsersByRestIds": 3600,
+}
+
+_WIRE_HEADERS = {"content-encoding", "content-length", "transfer-encoding"}
+
+
+class CachedResponse:
+    def __init__(
+        self, url: str, status: int, headers: dict, content: bytes, expires: float
+    ):
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.content = content
+        self.expires = expires
+
+    @property
+    def size(self):
+        return len(self.content)
+
+    @property
+    def expired(self):
+        return self.expires < time.time()
+
+    def to_response(self) -> httpx.Response:
+        return httpx.Response(
+            self.status,
+            headers=self.headers,
+            content=self.content,
+            request=httpx.Request("GET", self.url),
+            extensions={"redgalaxy_cache": "hit"},
+        )
+
+    def to_bytes(self) -> bytes:
+        meta = {
+            "url": self.url,
+            "status": self.status,
+            "headers": self.headers,
+            "expires": self.expires,
+        }
+        return json.dumps(meta).encode("utf-8") + b"\n" + self.content
+
+    @classmethod
+    def from_bytes(cls, data: bytes):
+        meta, _, content = data.partition(b"\n")
+        meta = json.loads(meta)
+        return cls(meta["url"], meta["status"], meta["headers"], content, meta["expires"])
+
+
+class ResponseCache:
+    def __init__(
+        self,
+        cacheFolder: typing.Optional[pathlib.Path] = pathlib.Path.home(),
+        ttl: float = 300,
+        routeTtls: dict = None,
+        maxMemory: int = 64 * 1024 * 1024,
+        maxDisk: int = 512 * 1024 * 1024,
+    ):
+        """
+        Keeps successful graphql responses so retries and overlapping queries don't download them again.
+        Responses are keyed on the route's operation name, its variables (which include the cursor) and its features.
+
+        :param cacheFolder: The folder where ".redgalaxy/responses" is kept. None to only cache in memory.
+        :param ttl: How long responses are kept for routes not in routeTtls, in seconds.
+        :param routeTtls: Per route ttls, on top of ROUTE_TTLS. 0 to never cache a route.
+        :param maxMemory: The max size of the response bodies kept in memory, in bytes.
+        :param maxDisk: The max size of the responses kept on disk, in bytes.
+        """
+        self.folder = (
+            None
+            if cacheFolder is None
+            else cacheFolder.resolve() / ".redgalaxy" / "responses"
+        )
+        self.ttl = ttl
+        self.routeTtls = {**ROUTE_TTLS, **(routeTtls or {})}
+        self.maxMemory = maxMemory
+        self.maxDisk = maxDisk
+        self.memory: typing.OrderedDict[str, CachedResponse] = collections.OrderedDict()
+        self.memorySize = 0
+        self._diskSize = None
+        self.hits = 0
+        self.diskHits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.logging = logging.getLogger("ResponseCache")
+
+    @staticmethod
+    def key(operation: str, variables: dict, features: dict = None) -> str:
+        """
+        :return: The cache key for a request. Dict ordering doesn't matter.
+        """
+        # The features rarely change, so their digest is reused rather than encoded every call.
+        canonical = json.dumps(
+            [operation, variables, frozen_digest(features)],
+            sort_keys=True,
+            separators=(",", ":"),
+        )
+        return f"{operation}-{hashlib.sha1(canonical.encode('utf-8')).hexdigest()}"
+
+    def route_ttl(self, operation: str) -> float:
+        return self.routeTtls.get(operation, self.ttl)
+
+    def get(self, key: str) -> typing.Optional[httpx.Response]:
+        """
+        :param key: A key from ResponseCache.key.
+        :return: The cached response or None.
+        """
+        cached = self.memory.get(key)
+        if cached is not None and cached.expired:
+            self._forget(key)
+            cached = None
+        if cached is None and self.folder is not None:
+            cached = self._read(key)
+            if cached is not None:
+                self.diskHits += 1
+                self._remember(key, cached)
+        if cached is None:
+            self.misses += 1
+            return None
+        self.memory.move_to_end(key)
+        self.hits += 1
+        return cached.to_response()
+
+    def put(self, key: str, operation: str, response: httpx.Response):
+        """
+        Caches a response. Only 200s are kept.
+
+        :param key: A key from ResponseCache.key.
+        :param operation: The route's operation name, for its ttl.
+        :param response: The httpx.Response.
+        """
+        ttl = self.route_ttl(operation)
+        if ttl <= 0 or response.status_code != 200:
+            return
+        # The body is kept decoded, so headers describing the wire format no longer apply.
+        headers = {
+            name: value
+            for name, value in response.headers.items()
+            if name.lower() not in _WIRE_HEADERS
+        }
+        cached = CachedResponse(
+            str(response.request.url),
+            response.status_code,
+            headers,
+            response.content,
+            time.time() + ttl,
+        )
+        self._remember(key, cached)
+        if self.folder is not None:
+            self._write(key, cached)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.diskHits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "memory_entries": len(self.memory),
+            "memory_bytes": self.memorySize,
+            "disk_bytes": self._disk_usage(),
+        }
+
+    def clear(self):
+        self.memory.clear()
+        self.memorySize = 0
+        if self.folder is not None and self.folder.exists():
+            for path in self.folder.glob("*.cache"):
+                path.unlink()
+        self._diskSize = 0
+
+    def _remember(self, key: str, cached: CachedResponse):
+        if cached.size > self.maxMemory:
+            return
+        self._forget(key)
+        self.memory[key] = cached
+        self.memorySize += cached.size
+        while self.memorySize > self.maxMemory:
+            _, oldest = self.memory.popitem(last=False)
+            self.memorySize -= oldest.size
+            self.evictions += 1
+
+    def _forget(self, key: str):
+        cached = self.memory.pop(key, None)
+        if cached is not None:
+            self.memorySize -= cached.size
+
+    def _disk_usage(self) -> int:
+        if self._diskSize is None:
+            if self.folder is None or not self.folder.exists():
+                return 0
+            self._diskSize = sum(
+                path.stat().st_size for path in self.folder.glob("*.cache")
+            )
+        return self._diskSize
+
+    def _path(self, key: str) -> pathlib.Path:
+        return self.folder / f"{key}.cache"
+
+    def _read(self, key: str) -> typing.Optional[CachedResponse]:
+        path = self._path(key)
+        try:
+            cached = CachedResponse.from_bytes(path.read_bytes())
+        except FileNotFoundError:
+            return None
+        except (ValueError, KeyError):
+            self.logging.debug(f"Dropping unreadable cache entry {path.name}")
+            self._unlink(path)
+            return None
+        if cached.expired:
+            self._unlink(path)
+            return None
+        return cached
+
+    def _write(self, key: str, cached: CachedResponse):
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self._disk_usage()
+        path = self._path(key)
+        data = cached.to_bytes()
+        if path.exists():
+            self._unlink(path)
+        temp = path.with_suffix(".tmp")
+        temp.write_bytes(data)
+        os.replace(temp, path)
+        self._diskSize += len(data)
+        if self._diskSize > self.maxDisk:
+            self._trim()
+
+    def _trim(self):
+        # Oldest written go first, down to 90% so a trim isn't needed on every write.
+        entries = sorted(
+            (path.stat().st_mtime, path) for path in self.folder.glob("*.cache")
+        )
+        for _, path in entries:
+            if self._diskSize <= self.maxDisk * 0.9:
+                break
+            self._unlink(path)
+            self.evictions += 1
+
+    def _unlink(self, path: pathlib.Path):
+        try:
+            size = path.stat().st_size
+            path.unlink()
+        except FileNotFoundError:
+            return
+        if self._diskSize is not None:
+            self._diskSize -= size
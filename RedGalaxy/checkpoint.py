@@ -0,0 +1,163 @@
+import hashlib
+import json
+import os
+import pathlib
+import sqlite3
+import time
+import typing
+
+
+class Checkpoint:
+    def __init__(self, query: str, mode: str):
+        """
+        How far a search has gotten. Saved after every page so the search can be resumed.
+
+        :param query: The search's query.
+        :param mode: The search's mode.
+        """
+        self.query = query
+        self.mode = mode
+        # The cursor of the page being consumed. None for the first page.
+        self.cursor: typing.Optional[str] = None
+        self.count = 0
+        # The last tweet handed to the consumer. Used to skip what was already yielded from a page on resume.
+        self.lastId: typing.Optional[int] = None
+        self.done = False
+        self.updated = time.time()
+
+    def turn(self, entries: list, cursors: dict):
+        """
+        Moves the checkpoint past a fully consumed page.
+
+        :param entries: The page's entries.
+        :param cursors: The page's {"top", "bottom"} cursors.
+        """
+        if entries and cursors["bottom"]:
+            self.cursor = cursors["bottom"]["value"]
+        else:
+            self.done = True
+
+    def resume_at(self, entries: list) -> int:
+        """
+        :param entries: The first page fetched after resuming.
+        :return: The index of the first entry that wasn't yielded before.
+        """
+        if self.lastId is None:
+            return 0
+        for idx, entry in enumerate(entries):
+            if entry["tweet"].id == self.lastId:
+                return idx + 1
+        return 0
+
+    def to_dict(self):
+        return {
+            "query": self.query,
+            "mode": self.mode,
+            "cursor": self.cursor,
+            "count": self.count,
+            "lastId": self.lastId,
+            "done": self.done,
+            "updated": self.updated,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        checkpoint = cls(data["query"], data["mode"])
+        checkpoint.cursor = data.get("cursor")
+        checkpoint.count = data.get("count", 0)
+        checkpoint.lastId = data.get("lastId")
+        checkpoint.done = data.get("done", False)
+        checkpoint.updated = data.get("updated", 0)
+        return checkpoint
+
+
+class CheckpointStore:
+    """
+    Where checkpoints are kept, by resume key.
+    """
+
+    def load(self, key: str) -> typing.Optional[Checkpoint]:
+        raise NotImplementedError()
+
+    def save(self, key: str, checkpoint: Checkpoint):
+        raise NotImplementedError()
+
+    def delete(self, key: str):
+        raise NotImplementedError()
+
+
+class FileCheckpointStore(CheckpointStore):
+    def __init__(self, cacheFolder: pathlib.Path = pathlib.Path.home()):
+        """
+        Keeps one json file per checkpoint.
+
+        :param cacheFolder: The folder where ".redgalaxy/checkpoints" is kept.
+        """
+        self.folder = cacheFolder.resolve() / ".redgalaxy" / "checkpoints"
+
+    def path(self, key: str) -> pathlib.Path:
+        # Keys can be anything, so they're hashed into a file name.
+        return self.folder / f"{hashlib.sha1(key.encode('utf-8')).hexdigest()}.json"
+
+    def load(self, key: str) -> typing.Optional[Checkpoint]:
+        path = self.path(key)
+        if not path.exists():
+            return None
+        try:
+            return Checkpoint.from_dict(json.loads(path.read_text(encoding="utf-8")))
+        except (ValueError, KeyError):
+            return None
+
+    def save(self, key: str, checkpoint: Checkpoint):
+        self.folder.mkdir(parents=True, exist_ok=True)
+        checkpoint.updated = time.time()
+        path = self.path(key)
+        # Write then rename, so a crash mid-write doesn't leave a broken checkpoint behind.
+        temp = path.with_suffix(".tmp")
+        temp.write_text(json.dumps({"key": key, **checkpoint.to_dict()}), encoding="utf-8")
+        os.replace(temp, path)
+
+    def delete(self, key: str):
+        path = self.path(key)
+        if path.exists():
+            path.unlink()
+
+
+class SQLiteCheckpointStore(CheckpointStore):
+    def __init__(self, database: typing.Union[str, pathlib.Path]):
+        """
+        Keeps checkpoints in a SQLite database. Handy when many searches are checkpointed at once.
+
+        :param database: The path to the database file.
+        """
+        self.connection = sqlite3.connect(str(database))
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS checkpoints (key TEXT PRIMARY KEY, data TEXT NOT NULL, updated REAL)"
+        )
+        self.connection.commit()
+
+    def load(self, key: str) -> typing.Optional[Checkpoint]:
+        row = self.connection.execute(
+            "SELECT data FROM checkpoints WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        try:
+            return Checkpoint.from_dict(json.loads(row[0]))
+        except (ValueError, KeyError):
+            return None
+
+    def save(self, key: str, checkpoint: Checkpoint):
+        checkpoint.updated = time.time()
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO checkpoints (key, data, updated) VALUES (?, ?, ?)",
+                (key, json.dumps(checkpoint.to_dict()), checkpoint.updated),
+            )
+
+    def delete(self, key: str):
+        with self.connection:
+            self.connection.execute("DELETE FROM checkpoints WHERE key = ?", (key,))
+
+    def close(self):
+        self.connection.close()
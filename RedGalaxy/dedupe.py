@@ -0,0 +1,170 @@
+import collections
+import datetime
+import hashlib
+import math
+import sys
+import typing
+
+
+class Deduper:
+    """
+    Remembers which tweet ids have been seen. Searches and streams drop entries it has seen before.
+    """
+
+    def add(self, tweet_id: int) -> bool:
+        """
+        Marks a tweet id as seen.
+
+        :param tweet_id: The tweet id.
+        :return: True if the id had not been seen before.
+        """
+        raise NotImplementedError()
+
+    def __contains__(self, tweet_id: int) -> bool:
+        raise NotImplementedError()
+
+    @property
+    def memory(self) -> int:
+        """
+        :return: Roughly how many bytes the seen ids take up.
+        """
+        raise NotImplementedError()
+
+    @property
+    def false_positive_rate(self) -> float:
+        """
+        :return: The chance a new id is wrongly reported as seen.
+        """
+        return 0.0
+
+    def stats(self) -> dict:
+        return {
+            "type": type(self).__name__,
+            "memory": self.memory,
+            "false_positive_rate": self.false_positive_rate,
+        }
+
+
+class SeenSet(Deduper):
+    def __init__(self):
+        """
+        Exact and unbounded. Fine for searches with a limit, not for long running streams.
+        """
+        self.seen = set()
+
+    def add(self, tweet_id: int) -> bool:
+        if tweet_id in self.seen:
+            return False
+        self.seen.add(tweet_id)
+        return True
+
+    def __contains__(self, tweet_id: int) -> bool:
+        return tweet_id in self.seen
+
+    def __len__(self):
+        return len(self.seen)
+
+    @property
+    def memory(self) -> int:
+        return sys.getsizeof(self.seen) + len(self.seen) * sys.getsizeof(2**62)
+
+
+class SnowflakeWindowSet(Deduper):
+    def __init__(self, window: datetime.timedelta = datetime.timedelta(days=1)):
+        """
+        Exact, but only remembers ids within `window` of the last id added.
+        Searches and streams walk through time in one direction, so repeats land close together.
+        Ids that drift out of the window are forgotten and would be reported as new again.
+
+        :param window: How far apart in time, by their snowflake, remembered ids can be.
+        """
+        self.window = int(window.total_seconds() * 1000) << 22
+        self.seen = set()
+        self._order = collections.deque()
+
+    def add(self, tweet_id: int) -> bool:
+        if tweet_id in self.seen:
+            return False
+        self.seen.add(tweet_id)
+        self._order.append(tweet_id)
+        # Oldest insertions are the furthest away in a one-way walk, whichever way it goes.
+        while abs(self._order[0] - tweet_id) > self.window:
+            self.seen.discard(self._order.popleft())
+        return True
+
+    def __contains__(self, tweet_id: int) -> bool:
+        return tweet_id in self.seen
+
+    def __len__(self):
+        return len(self.seen)
+
+    @property
+    def memory(self) -> int:
+        return (
+            sys.getsizeof(self.seen)
+            + sys.getsizeof(self._order)
+            + len(self.seen) * sys.getsizeof(2**62)
+        )
+
+
+class RotatingBloomFilter(Deduper):
+    def __init__(self, capacity: int = 1_000_000, error_rate: float = 0.0001):
+        """
+        Fixed memory, at the cost of the odd new id being reported as seen.
+        Two generations are kept. Once the current one holds `capacity` ids, the older one is dropped,
+        so the last `capacity` to 2x `capacity` ids are always remembered.
+
+        :param capacity: The number of ids per generation.
+        :param error_rate: The false positive rate of a full generation.
+        """
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.bits = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.bits / capacity * math.log(2)))
+        self._current = bytearray((self.bits + 7) // 8)
+        self._previous = bytearray((self.bits + 7) // 8)
+        self._count = 0
+        self._previousCount = 0
+
+    def _positions(self, tweet_id: int) -> typing.List[int]:
+        digest = hashlib.blake2b(
+            tweet_id.to_bytes(8, "little", signed=False), digest_size=16
+        ).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    @staticmethod
+    def _test(bits: bytearray, positions: typing.List[int]) -> bool:
+        return all(bits[pos >> 3] & (1 << (pos & 7)) for pos in positions)
+
+    def add(self, tweet_id: int) -> bool:
+        positions = self._positions(tweet_id)
+        if self._test(self._current, positions) or self._test(self._previous, positions):
+            return False
+        if self._count >= self.capacity:
+            self._previous, self._current = self._current, bytearray(len(self._current))
+            self._previousCount, self._count = self._count, 0
+        for pos in positions:
+            self._current[pos >> 3] |= 1 << (pos & 7)
+        self._count += 1
+        return True
+
+    def __contains__(self, tweet_id: int) -> bool:
+        positions = self._positions(tweet_id)
+        return self._test(self._current, positions) or self._test(
+            self._previous, positions
+        )
+
+    @property
+    def memory(self) -> int:
+        return len(self._current) + len(self._previous)
+
+    def _rate(self, count: int) -> float:
+        return (1 - math.exp(-self.hashes * count / self.bits)) ** self.hashes
+
+    @property
+    def false_positive_rate(self) -> float:
+        # Either generation can cause a false positive.
+        return 1 - (1 - self._rate(self._count)) * (1 - self._rate(self._previousCount))
+
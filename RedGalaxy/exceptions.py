@@ -8,3 +8,7 @@ class SessionManagerException(RedGalaxyException):
 
 class XAuthException(RedGalaxyException):
     pass
+
+
+class HighGravityException(RedGalaxyException):
+    pass
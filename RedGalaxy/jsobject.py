@@ -0,0 +1,172 @@
+import logging
+import re
+import typing
+
+from .exceptions import HighGravityException
+
+# Just enough of a JS parser to read the object literals twitter's bundles export.
+# Anything that isn't a literal (function calls, variable references...) is an error.
+
+_whitespace = re.compile(r"(?:\s+|//[^\n]*|/\*.*?\*/)*", re.S)
+_identifier = re.compile(r"[A-Za-z_$][\w$]*")
+_number = re.compile(
+    r"-?(?:0[xX][0-9a-fA-F]+|(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)"
+)
+_strings = {
+    '"': re.compile(r'"((?:[^"\\\n]|\\.)*)"', re.S),
+    "'": re.compile(r"'((?:[^'\\\n]|\\.)*)'", re.S),
+    "`": re.compile(r"`((?:[^`\\$]|\\.|\$(?!\{))*)`", re.S),
+}
+_escape = re.compile(r"\\(u\{[0-9a-fA-F]+\}|u[0-9a-fA-F]{4}|x[0-9a-fA-F]{2}|\n|.)", re.S)
+_escapes = {"n": "\n", "t": "\t", "r": "\r", "b": "\b", "f": "\f", "v": "\v", "0": "\0"}
+_keywords = {
+    "true": True,
+    "false": False,
+    "null": None,
+    "undefined": None,
+    # Minified booleans.
+    "!0": True,
+    "!1": False,
+    "void 0": None,
+}
+_keyword = re.compile(r"!0|!1|void 0|true|false|null|undefined")
+# Where a route object starts in a bundle: {e.exports={queryId:...
+_exports = re.compile(r"\{e\.exports=(?=\{)")
+_logging = logging.getLogger("HighGravity")
+
+
+def _unescape(match: typing.Match) -> str:
+    seq = match.group(1)
+    if seq[0] == "u":
+        return chr(int(seq[1:].strip("{}"), 16))
+    if seq[0] == "x":
+        return chr(int(seq[1:], 16))
+    if seq == "\n":
+        # Line continuation.
+        return ""
+    return _escapes.get(seq, seq)
+
+
+class _Parser:
+    def __init__(self, source: str, pos: int = 0):
+        self.source = source
+        self.pos = pos
+
+    def error(self, message):
+        snippet = self.source[self.pos : self.pos + 30]
+        raise HighGravityException(f"{message} at {self.pos}: {snippet!r}")
+
+    def skip(self):
+        self.pos = _whitespace.match(self.source, self.pos).end()
+
+    def peek(self) -> str:
+        self.skip()
+        return self.source[self.pos : self.pos + 1]
+
+    def expect(self, char):
+        if self.peek() != char:
+            self.error(f"Expected {char!r}")
+        self.pos += 1
+
+    def string(self) -> str:
+        match = _strings[self.source[self.pos]].match(self.source, self.pos)
+        if not match:
+            self.error("Unterminated string")
+        self.pos = match.end()
+        body = match.group(1)
+        return _escape.sub(_unescape, body) if "\\" in body else body
+
+    def number(self) -> typing.Union[int, float]:
+        match = _number.match(self.source, self.pos)
+        if not match:
+            self.error("Invalid number")
+        self.pos = match.end()
+        text = match.group(0)
+        if text.lstrip("-")[:2] in ("0x", "0X"):
+            return int(text, 16)
+        if "." in text or "e" in text or "E" in text:
+            return float(text)
+        return int(text)
+
+    def key(self) -> str:
+        char = self.peek()
+        if char in _strings:
+            return self.string()
+        if char.isdigit():
+            return str(self.number())
+        match = _identifier.match(self.source, self.pos)
+        if not match:
+            self.error("Invalid key")
+        self.pos = match.end()
+        return match.group(0)
+
+    def value(self):
+        char = self.peek()
+        if char == "{":
+            return self.object()
+        if char == "[":
+            return self.array()
+        if char in _strings:
+            return self.string()
+        if char == "-" or char == "." or char.isdigit():
+            return self.number()
+        match = _keyword.match(self.source, self.pos)
+        if match:
+            end = match.end()
+            # Make sure it's not the start of a longer identifier. (e.g. "nullable")
+            if not _identifier.match(self.source, end) or match.group(0)[0] == "!":
+                self.pos = end
+                return _keywords[match.group(0)]
+        self.error("Unsupported value")
+
+    def object(self) -> dict:
+        self.expect("{")
+        result = {}
+        while self.peek() != "}":
+            key = self.key()
+            self.expect(":")
+            result[key] = self.value()
+            if self.peek() == ",":
+                self.pos += 1
+            elif self.peek() != "}":
+                self.error("Expected ',' or '}'")
+        self.pos += 1
+        return result
+
+    def array(self) -> list:
+        self.expect("[")
+        result = []
+        while self.peek() != "]":
+            result.append(self.value())
+            if self.peek() == ",":
+                self.pos += 1
+            elif self.peek() != "]":
+                self.error("Expected ',' or ']'")
+        self.pos += 1
+        return result
+
+
+def parse_object(source: str, pos: int = 0) -> typing.Tuple[dict, int]:
+    """
+    Parses a JS object literal.
+
+    :param source: The JS source.
+    :param pos: Where the object starts.
+    :return: The object as a dict and the position right after it.
+    """
+    parser = _Parser(source, pos)
+    return parser.object(), parser.pos
+
+
+def iter_exports(js: str) -> typing.Iterator[dict]:
+    """
+    Yields every `e.exports={...}` object literal in a bundle.
+    Exports that aren't plain literals are skipped. Bundles export plenty of things that aren't routes.
+
+    :param js: The bundle's source.
+    """
+    for match in _exports.finditer(js):
+        try:
+            yield parse_object(js, match.end())[0]
+        except HighGravityException as e:
+            _logging.debug(f"Skipping export: {e}")
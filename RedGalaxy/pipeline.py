@@ -0,0 +1,195 @@
+import asyncio
+import collections
+import sys
+import time
+import typing
+
+from .exceptions import RedGalaxyException
+
+
+def tweets(page: tuple) -> int:
+    """
+    Sizes an (entries, cursors) page by its number of tweets.
+    """
+    return len(page[0])
+
+
+def footprint(obj) -> int:
+    """
+    Roughly how much memory an object and everything it holds takes up, in bytes.
+    """
+    seen = set()
+    stack = [obj]
+    total = 0
+    while stack:
+        item = stack.pop()
+        if id(item) in seen or isinstance(item, type):
+            continue
+        seen.add(id(item))
+        total += sys.getsizeof(item)
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset, collections.deque)):
+            stack.extend(item)
+        elif hasattr(item, "__dict__"):
+            stack.append(item.__dict__)
+    return total
+
+
+class BoundedQueue:
+    def __init__(
+        self, maxSize: int = 1, sizer: typing.Callable[[typing.Any], int] = None
+    ):
+        """
+        A queue between a producer and a consumer that holds at most `maxSize` worth of items.
+        When it's full, the producer waits for the consumer to catch up.
+
+        :param maxSize: How much the queue holds, in whatever the sizer measures.
+        :param sizer: Measures an item. Defaults to 1 per item. See `tweets` and `footprint`.
+        An item bigger than maxSize is still let in once the queue is empty.
+
+        A queue can be reused for one producer after another. See attach.
+        """
+        self.maxSize = max(1, maxSize)
+        self.sizer = sizer
+        self.size = 0
+        self.peakSize = 0
+        # Time spent by the producer waiting on a full queue, and by the consumer waiting on an empty one.
+        self.stallTime = 0.0
+        self.starveTime = 0.0
+        self.stalls = 0
+        self._items: typing.Deque[typing.Tuple[typing.Any, int]] = collections.deque()
+        self._closed = False
+        self._error: typing.Optional[BaseException] = None
+        self._attached = False
+        self._condition: typing.Optional[asyncio.Condition] = None
+
+    @property
+    def condition(self) -> asyncio.Condition:
+        # Made on first use so it belongs to the running loop.
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    @property
+    def depth(self) -> int:
+        return len(self._items)
+
+    def _fits(self, size: int) -> bool:
+        return not self._items or self.size + size <= self.maxSize
+
+    async def put(self, item):
+        size = 1 if self.sizer is None else self.sizer(item)
+        async with self.condition:
+            if not self._fits(size):
+                started = time.monotonic()
+                self.stalls += 1
+                await self.condition.wait_for(lambda: self._fits(size))
+                self.stallTime += time.monotonic() - started
+            self._items.append((item, size))
+            self.size += size
+            self.peakSize = max(self.peakSize, self.size)
+            self.condition.notify_all()
+
+    async def get(self):
+        """
+        :return: The next item. Raises StopAsyncIteration once the queue is closed and empty,
+        or the error it was closed with.
+        """
+        async with self.condition:
+            if not self._items and not self._closed:
+                started = time.monotonic()
+                await self.condition.wait_for(lambda: self._items or self._closed)
+                self.starveTime += time.monotonic() - started
+            if not self._items:
+                if self._error is not None:
+                    raise self._error
+                raise StopAsyncIteration
+            item, size = self._items.popleft()
+            self.size -= size
+            self.condition.notify_all()
+            return item
+
+    async def close(self, error: BaseException = None):
+        """
+        Marks the end of the items. The consumer gets what's left, then `error` if one is given.
+        """
+        async with self.condition:
+            self._closed = True
+            self._error = error
+            self.condition.notify_all()
+
+    def attach(self):
+        """
+        Readies the queue for a new producer: reopens it and drops anything the last consumer left behind.
+        The stats keep counting across producers.
+        Raises RedGalaxyException if another producer is still using it.
+        """
+        if self._attached:
+            raise RedGalaxyException("BoundedQueue is already in use by another producer.")
+        self._attached = True
+        self._closed = False
+        self._error = None
+        self._items.clear()
+        self.size = 0
+
+    def detach(self):
+        self._attached = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.get()
+
+    def stats(self) -> dict:
+        return {
+            "depth": self.depth,
+            "size": self.size,
+            "max_size": self.maxSize,
+            "peak_size": self.peakSize,
+            "stalls": self.stalls,
+            "stall_time": self.stallTime,
+            "starve_time": self.starveTime,
+        }
+
+
+async def prefetch(
+    source: typing.AsyncIterator, depth: int = 1, queue: BoundedQueue = None
+):
+    """
+    Runs an async iterator ahead of its consumer, buffering at most `depth` items.
+
+    :param source: The async iterator to run ahead.
+    :param depth: The max number of items fetched but not yet consumed.
+    :param queue: A BoundedQueue to buffer through instead, for other limits or to watch its stats.
+    :return: An async generator of the source's items.
+    """
+    if queue is None:
+        queue = BoundedQueue(depth)
+    queue.attach()
+
+    async def produce():
+        try:
+            async for item in source:
+                await queue.put(item)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await queue.close(e)
+        else:
+            await queue.close()
+
+    producer = asyncio.ensure_future(produce())
+    try:
+        async for item in queue:
+            yield item
+    finally:
+        producer.cancel()
+        # Let the producer unwind before the source is closed and the queue handed to someone else.
+        await asyncio.gather(producer, return_exceptions=True)
+        aclose = getattr(source, "aclose", None)
+        if aclose is not None:
+            await aclose()
+        queue.detach()
@@ -0,0 +1,142 @@
+import asyncio
+import logging
+import time
+import typing
+import urllib.parse
+
+import httpx
+
+
+class RouteBudget:
+    def __init__(self):
+        """
+        What twitter last told us about a route's rate limit for a single token.
+        """
+        self.limit: typing.Optional[int] = None
+        self.remaining: typing.Optional[int] = None
+        self.reset: float = 0
+        self.inflight = 0
+        self.last = 0.0
+
+    @property
+    def free(self):
+        """
+        :return: The number of requests that can still be sent before the reset. None if unknown.
+        """
+        if self.remaining is None:
+            return None
+        if self.reset and self.reset <= time.time():
+            # The window has passed. Assume the full budget is back until told otherwise.
+            return (self.limit or 1) - self.inflight
+        return self.remaining - self.inflight
+
+
+class RateLimiter:
+    # How long to wait when a budget is exhausted but twitter didn't send a reset.
+    fallback_wait = 1.0
+    # How long a route is benched for a token when twitter 429s without a reset.
+    park_time = 900
+
+    def __init__(self, pace: bool = False):
+        """
+        Learns rate limit budgets from twitter's x-rate-limit-* headers, per route and per guest token,
+        and holds requests back so they arrive just under the limit instead of bouncing off a 429.
+
+        :param pace: Spread the remaining budget evenly over the window instead of bursting until it runs out.
+        """
+        self.pace = pace
+        self.budgets: typing.Dict[typing.Tuple[str, typing.Optional[str]], RouteBudget] = {}
+        self.logging = logging.getLogger("RateLimiter")
+
+    @staticmethod
+    def route_name(url) -> str:
+        """
+        Turns a url into a route key. GraphQL routes are keyed by their operation name.
+
+        :param url: The request url.
+        :return: The route key. (e.g. SearchTimeline or /1.1/guest/activate.json)
+        """
+        path = urllib.parse.urlsplit(str(url)).path
+        if "/graphql/" in path:
+            return path.rstrip("/").rsplit("/", 1)[-1]
+        return path
+
+    def budget(self, route: str, token: typing.Optional[str]) -> RouteBudget:
+        key = (route, token)
+        if key not in self.budgets:
+            self.budgets[key] = RouteBudget()
+        return self.budgets[key]
+
+    def available(self, route: str, token: typing.Optional[str]) -> bool:
+        """
+        :return: True if a request for the route with this token would go out without waiting.
+        """
+        free = self.budget(route, token).free
+        return free is None or free > 0
+
+    def wait_time(self, route: str, token: typing.Optional[str]) -> float:
+        """
+        :return: Roughly how long until the route has budget again for this token, in seconds. 0 if it has.
+        """
+        if self.available(route, token):
+            return 0.0
+        budget = self.budget(route, token)
+        return max(budget.reset - time.time(), self.fallback_wait)
+
+    async def acquire(self, route: str, token: typing.Optional[str]):
+        """
+        Waits until the route has budget left for the token and reserves one request.
+
+        :param route: The route key.
+        :param token: The guest token the request is sent with.
+        """
+        budget = self.budget(route, token)
+        while True:
+            now = time.time()
+            free = budget.free
+            if free is None:
+                break
+            if free > 0:
+                if not self.pace or not budget.reset or budget.reset <= now:
+                    break
+                wait = budget.last + (budget.reset - now) / free - now
+                if wait <= 0:
+                    break
+            else:
+                wait = budget.reset - now if budget.reset > now else self.fallback_wait
+                self.logging.debug(f"{route} exhausted. Waiting {wait:.2f}s for reset.")
+            await asyncio.sleep(wait)
+        budget.inflight += 1
+        budget.last = time.time()
+
+    def release(
+        self,
+        route: str,
+        token: typing.Optional[str],
+        response: typing.Optional[httpx.Response] = None,
+    ):
+        """
+        Releases a reservation and learns the budget from the response headers.
+
+        :param route: The route key.
+        :param token: The guest token the request was sent with.
+        :param response: The response, if there was one.
+        """
+        budget = self.budget(route, token)
+        budget.inflight = max(0, budget.inflight - 1)
+        if response is None:
+            return
+        limit = response.headers.get("x-rate-limit-limit")
+        remaining = response.headers.get("x-rate-limit-remaining")
+        reset = response.headers.get("x-rate-limit-reset")
+        if limit is not None and limit.isdigit():
+            budget.limit = int(limit)
+        if remaining is not None and remaining.isdigit():
+            budget.remaining = int(remaining)
+        if reset is not None and reset.isdigit():
+            budget.reset = int(reset)
+        if response.status_code == 429:
+            budget.remaining = 0
+            if budget.reset <= time.time():
+                # Without a reset the budget would never come back.
+                budget.reset = time.time() + self.park_time
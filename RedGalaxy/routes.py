@@ -0,0 +1,343 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+import typing
+
+import httpx
+
+from .exceptions import RedGalaxyException
+
+# Values for feature switches a route declares but the caller didn't set.
+# Mostly what twitter's web client sends. Anything not listed here is sent as False.
+FEATURE_DEFAULTS = {
+    "blue_business_profile_image_shape_enabled": True,
+    "creator_subscriptions_tweet_preview_api_enabled": True,
+    "graphql_is_translatable_rweb_tweet_is_translatable_enabled": True,
+    "highlights_tweets_tab_ui_enabled": True,
+    "longform_notetweets_consumption_enabled": True,
+    "longform_notetweets_inline_media_enabled": True,
+    "longform_notetweets_rich_text_read_enabled": True,
+    "responsive_web_enhance_cards_enabled": False,
+    "responsive_web_graphql_exclude_directive_enabled": True,
+    "responsive_web_graphql_skip_user_profile_image_extensions_enabled": False,
+    "responsive_web_graphql_timeline_navigation_enabled": True,
+    "responsive_web_text_conversations_enabled": False,
+    "responsive_web_twitter_blue_verified_badge_is_enabled": True,
+    "rweb_lists_timeline_redesign_enabled": True,
+    "standardized_nudges_misinfo": True,
+    "tweetypie_unmention_optimization_enabled": True,
+    "verified_phone_label_enabled": False,
+    "view_counts_everywhere_api_enabled": True,
+    "vibe_api_enabled": True,
+}
+
+# id(dict) -> (dict, digest). The dict is kept so its id can't be reused while it's cached.
+_digests: typing.Dict[int, typing.Tuple[dict, str]] = {}
+
+
+def frozen_digest(mapping: typing.Optional[dict]) -> str:
+    """
+    A stable digest of a dict's contents, worked out once per dict object.
+    Feature and header dicts are treated as frozen once they've been sent.
+    To change flags after that, use RouteRegistry.override or pass a new dict.
+
+    :param mapping: The dict, usually a class level feature dict.
+    :return: A hex digest. Equal contents give equal digests.
+    """
+    if not mapping:
+        return ""
+    cached = _digests.get(id(mapping))
+    if cached is not None and cached[0] is mapping:
+        return cached[1]
+    if len(_digests) >= 256:
+        # Callers building a fresh dict for every request would otherwise grow this forever.
+        _digests.clear()
+    digest = hashlib.sha1(
+        json.dumps(mapping, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    ).hexdigest()
+    _digests[id(mapping)] = (mapping, digest)
+    return digest
+
+
+class RouteTemplate:
+    def __init__(
+        self,
+        operation: str,
+        route: list,
+        features: dict,
+        rewrite: bool = False,
+        headers: dict = None,
+        defaults: dict = None,
+    ):
+        """
+        Everything about a graphql request that doesn't change between calls, worked out once.
+        The features sent are the route's own featureSwitches, filled from `features` first, then `defaults`.
+
+        :param operation: The route's operation name. (e.g. SearchTimeline)
+        :param route: The [url, metadata] pair from the route table.
+        :param features: The flags to send, already combined. See RouteRegistry.override.
+        :param rewrite: Send the request through twitter.com/i/api instead of api.twitter.com.
+        :param headers: Extra headers sent with every request to the route.
+        :param defaults: Values for switches `features` doesn't cover. Defaults to FEATURE_DEFAULTS.
+        """
+        self.operation = operation
+        self.source = route[0]
+        self.url = (
+            self.source.replace("https://api.twitter.com/", "https://twitter.com/i/api/")
+            if rewrite
+            else self.source
+        )
+        self.featureSwitches = route[1].get("featureSwitches", [])
+        defaults = FEATURE_DEFAULTS if defaults is None else defaults
+        if self.featureSwitches:
+            self.features = {
+                feature: features[feature]
+                if feature in features
+                else defaults.get(feature, False)
+                for feature in self.featureSwitches
+            }
+        else:
+            # No metadata to go off. Send what we were given.
+            self.features = dict(features)
+        self.missing = [
+            feature
+            for feature in self.featureSwitches
+            if feature not in features and feature not in defaults
+        ]
+        self.encodedFeatures = json.dumps(self.features, separators=(",", ":"))
+        self.headers = headers or {}
+
+    def params(self, variables: dict) -> dict:
+        """
+        :param variables: The route's variables.
+        :return: The query params for a request.
+        """
+        return {
+            "variables": json.dumps(variables, separators=(",", ":")),
+            "features": self.encodedFeatures,
+        }
+
+
+class RouteRegistry:
+    def __init__(
+        self,
+        session,
+        refreshInterval: float = 3600,
+        revalidateInterval: float = 1800,
+        forceInterval: float = 60,
+    ):
+        """
+        The route table shared by every API object on a session.
+        Discovery runs once no matter how many coroutines ask for routes at the same time,
+        and after the first fill, refreshes happen in the background.
+
+        :param session: The SessionManager that owns the registry.
+        :param refreshInterval: How old the routes can get before a background refresh is started, in seconds.
+        :param revalidateInterval: How often routes are checked against twitter's homepage
+        in the background, in seconds. 0 to disable.
+        :param forceInterval: The least time between rescrapes caused by stale responses, in seconds.
+        """
+        self.session = session
+        self.refreshInterval = refreshInterval
+        self.revalidateInterval = revalidateInterval
+        self.routes: dict = {}
+        self.loaded = 0.0
+        self.templates: typing.Dict[tuple, RouteTemplate] = {}
+        self.featureDefaults = dict(FEATURE_DEFAULTS)
+        self.featureOverrides: typing.Dict[str, dict] = {}
+        self.forceInterval = forceInterval
+        self.forced = 0.0
+        # operation -> (time, url) of the last forced refresh it caused.
+        self.forcedUrls: typing.Dict[str, typing.Tuple[float, typing.Optional[str]]] = {}
+        self._gravity = None
+        self._fill: typing.Optional[asyncio.Future] = None
+        self._scheduler: typing.Optional[asyncio.Task] = None
+        self.logging = logging.getLogger("RouteRegistry")
+
+    @property
+    def gravity(self):
+        if self._gravity is None:
+            from .HighGravity import HighGravity
+
+            self._gravity = HighGravity(self.session)
+        return self._gravity
+
+    @property
+    def stale(self):
+        return self.loaded < time.time() - self.refreshInterval
+
+    async def get(self) -> dict:
+        """
+        :return: The route table. Only waits on discovery if it has never been filled.
+        """
+        if not self.routes:
+            return await self.refresh()
+        if self.stale and self._fill is None:
+            self.logging.debug("Routes are stale. Refreshing in the background.")
+            self._start()
+        return self.routes
+
+    async def refresh(self, force: bool = False, revalidate: bool = False) -> dict:
+        """
+        Refreshes the route table. Concurrent callers share the same discovery.
+
+        :param force: Skip the on-disk route cache.
+        :param revalidate: Check the on-disk route cache against twitter's homepage even if it's within its ttl.
+        :return: The route table.
+        """
+        if self._fill is None:
+            self._start(force, revalidate)
+        return await asyncio.shield(self._fill)
+
+    async def template(
+        self, operation: str, features: dict, rewrite: bool = False, headers: dict = None
+    ) -> RouteTemplate:
+        """
+        Gets the compiled template for a route. Templates are built once per route table.
+
+        :param operation: The route's operation name. (e.g. SearchTimeline)
+        :param features: The caller's feature flags. See override for how they're combined.
+        :param rewrite: Send the request through twitter.com/i/api instead of api.twitter.com.
+        :param headers: Extra headers sent with every request to the route.
+        :return: A RouteTemplate.
+        """
+        routes = await self.get()
+        key = (operation, frozen_digest(features), rewrite, frozen_digest(headers))
+        template = self.templates.get(key)
+        if template is not None:
+            return template
+        route = routes.get(operation)
+        if not route:
+            self.logging.error("Routes list:")
+            self.logging.error(routes)
+            raise RedGalaxyException(f"Missing routes? {operation} not found.")
+        template = RouteTemplate(
+            operation,
+            route,
+            {**self.featureOverrides.get(operation, {}), **features},
+            rewrite,
+            headers,
+            self.featureDefaults,
+        )
+        # Twitter raises an error if we have a missing feature not present in the list.
+        # Those are filled in, but a guessed False may not be what twitter expects.
+        for feature in template.missing:
+            self.logging.warning(
+                f"{feature} found in featureSwitch but missing in setFeatures. Sending False."
+            )
+        self.templates[key] = template
+        return template
+
+    def override(self, operation: str, **features):
+        """
+        Sets feature flags for a route.
+        Only the switches the route declares in its featureSwitches are sent. Each one is taken from
+        the flags the API object sends (e.g. TwitterSearch.featureFlags), then from these overrides,
+        then from featureDefaults, and is False otherwise.
+
+        :param operation: The route's operation name. (e.g. SearchTimeline)
+        :param features: The feature flags to set.
+        """
+        self.featureOverrides.setdefault(operation, {}).update(features)
+        self.templates = {
+            key: template
+            for key, template in self.templates.items()
+            if key[0] != operation
+        }
+
+    async def invalidate(self, operation: str, url: str) -> dict:
+        """
+        Reports that a route's url has gone stale. The table is rescraped once,
+        no matter how many requests hit the stale url.
+        Rescrapes are at least forceInterval apart. A url the last rescrape for the operation
+        already returned isn't rescraped again until the next scheduled refresh.
+
+        :param operation: The route's operation name. (e.g. SearchTimeline)
+        :param url: The url that failed.
+        :return: The route table.
+        """
+        if self._fill is not None:
+            await asyncio.shield(self._fill)
+        route = self.routes.get(operation)
+        if route and route[0] != url:
+            # Someone else already refreshed it.
+            return self.routes
+        now = time.time()
+        if now - self.forced < self.forceInterval:
+            self.logging.debug(f"{operation} looks stale ({url}), but routes were just rescraped.")
+            return self.routes
+        forced, forcedUrl = self.forcedUrls.get(operation, (0.0, None))
+        if forcedUrl == url and now - forced < self.refreshInterval:
+            # A rescrape already gave us this url. Another one won't find a different one.
+            self.logging.debug(f"{operation} looks stale ({url}), but rescraping didn't change it.")
+            return self.routes
+        self.logging.warning(f"{operation} looks stale ({url}). Refreshing routes.")
+        self.forced = now
+        routes = await self.refresh(force=True)
+        route = routes.get(operation)
+        self.forcedUrls[operation] = (now, route[0] if route else None)
+        return routes
+
+    @staticmethod
+    def stale_response(response: httpx.Response) -> bool:
+        """
+        Checks if a graphql response failed because the queryId is no longer valid.
+        Twitter 404s unknown queryIds and sometimes returns a validation error instead.
+        """
+        if response.status_code == 404:
+            return True
+        if response.status_code not in (400, 422):
+            return False
+        try:
+            errors = json.loads(response.content).get("errors", [])
+        except (ValueError, AttributeError):
+            return False
+        for error in errors:
+            message = str(error.get("message", "")).lower()
+            code = str(error.get("extensions", {}).get("code", "")).upper()
+            if "query not found" in message or code == "GRAPHQL_VALIDATION_FAILED":
+                return True
+        return False
+
+    def _start(self, force: bool = False, revalidate: bool = False):
+        self._fill = asyncio.ensure_future(self._retrieve(force, revalidate))
+        self._fill.add_done_callback(self._fill_done)
+
+    def _fill_done(self, task: asyncio.Future):
+        if self._fill is task:
+            self._fill = None
+        if not task.cancelled() and task.exception():
+            self.logging.warning(f"Route discovery failed: {task.exception()!r}")
+
+    async def _retrieve(self, force: bool, revalidate: bool) -> dict:
+        routes = await self.gravity.retrieve_routes(force=force, revalidate=revalidate)
+        if routes:
+            if routes != self.routes:
+                self.templates = {}
+            self.routes = routes
+            self.loaded = time.time()
+            if self.revalidateInterval and (
+                self._scheduler is None or self._scheduler.done()
+            ):
+                # A finished scheduler means its loop was closed (e.g. between asyncio.run calls).
+                self._scheduler = asyncio.ensure_future(self._revalidate())
+        return self.routes
+
+    async def _revalidate(self):
+        # Keeps checking routes so a rotated queryId is usually caught before a request hits it.
+        while True:
+            await asyncio.sleep(self.revalidateInterval)
+            try:
+                await self.refresh(revalidate=True)
+            except Exception as e:
+                self.logging.warning(f"Route revalidation failed: {e!r}")
+
+    def stop(self):
+        """
+        Stops the background revalidation.
+        """
+        if self._scheduler is not None and not self._scheduler.done():
+            self._scheduler.cancel()
+        self._scheduler = None
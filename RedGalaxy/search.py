@@ -1,8 +1,155 @@
 import asyncio
-import json
+import bisect
+import collections
+import datetime
+import itertools
+import math
+import time
+import typing
 import urllib.parse
 
-from . import global_instance, SessionManager, UtilBox, RedGalaxyException, HighGravity
+from . import get_global_instance, SessionManager, UtilBox, RedGalaxyException, pipeline
+from .dedupe import Deduper, SnowflakeWindowSet, RotatingBloomFilter
+from .checkpoint import Checkpoint, CheckpointStore, FileCheckpointStore
+
+
+class SearchWindow:
+    def __init__(self, lo: int, hi: int):
+        """
+        A slice of a search between two tweet ids.
+
+        :param lo: The since_id. Tweets in the window are newer than this.
+        :param hi: The max_id. Tweets in the window are this or older.
+        """
+        self.lo = lo
+        self.hi = hi
+        self.entries = collections.deque()
+        self.done = False
+
+    def query(self, query: str) -> str:
+        return f"{query} since_id:{self.lo} max_id:{self.hi}"
+
+    @property
+    def span(self) -> int:
+        # Snowflake ids grow with time, so the id range stands in for the time range.
+        return (self.hi >> 22) - (self.lo >> 22)
+
+    def split(self, hi: int, pieces: int) -> typing.List["SearchWindow"]:
+        """
+        Splits what's left of the window below `hi` into evenly timed pieces, newest first.
+        """
+        top = hi >> 22
+        step = max(1, math.ceil((top - (self.lo >> 22)) / pieces))
+        windows = []
+        while hi > self.lo:
+            lo = max(self.lo, (top - step) << 22)
+            windows.append(SearchWindow(lo, hi))
+            hi, top = lo, top - step
+        return windows
+
+
+class Watermark:
+    def __init__(self, value: typing.Union[int, datetime.datetime] = None):
+        """
+        The newest tweet an earlier run got to. A Latest search given a watermark stops as soon as it reaches it.
+        Once the search has walked all the way down to it, `value` moves up to the newest tweet that run saw.
+        It only moves once the run is complete, so a run that stops early doesn't leave a gap behind.
+
+        :param value: A tweet id or datetime. None to search everything the first time.
+        """
+        self.value = 0 if value is None else UtilBox.as_snowflake(value)
+        self.newest = self.value
+
+    def reached(self, tweet_id: int) -> bool:
+        return tweet_id <= self.value
+
+    def saw(self, tweet_id: int):
+        if tweet_id > self.newest:
+            self.newest = tweet_id
+
+    def advance(self):
+        self.value = self.newest
+
+
+class PageSize:
+    def __init__(
+        self,
+        start: int = 20,
+        minimum: int = 20,
+        maximum: int = 100,
+        slow: float = 5.0,
+        tolerance: float = 0.2,
+        reprobe: int = 10,
+    ):
+        """
+        Works out the largest page size a search product honors.
+        The count doubles while pages come back full and fast. If a page bigger than any already honored comes
+        back short while there are more pages to go, that's taken as the route's cap. Slow pages halve the count.
+
+        :param start: The count to start with.
+        :param minimum: The smallest count it backs off to.
+        :param maximum: The largest count it probes.
+        :param slow: Pages taking longer than this, in seconds, are slow.
+        :param tolerance: How far short of the count a page can be and still count as full.
+        Twitter drops filtered and deleted tweets from pages, so they often come back a little short.
+        :param reprobe: After this many full pages at the cap, probe above it again.
+        """
+        self.count = start
+        self.minimum = minimum
+        self.maximum = maximum
+        self.ceiling = maximum
+        self.slow = slow
+        self.tolerance = tolerance
+        self.reprobe = reprobe
+        # The largest count that has come back full.
+        self.honored = 0
+        self.requests = 0
+        self.tweets = 0
+        self._fullAtCeiling = 0
+
+    def observe(self, asked: int, got: int, elapsed: float, more: bool):
+        """
+        :param asked: The count the page was requested with.
+        :param got: The number of tweets on the page.
+        :param elapsed: How long the page took, in seconds.
+        :param more: Whether there are pages after this one.
+        """
+        self.requests += 1
+        self.tweets += got
+        if elapsed > self.slow:
+            self.count = max(self.minimum, self.count // 2)
+            return
+        if not more:
+            # The last page is short because the results ran out, not because of the route.
+            return
+        if got >= asked * (1 - self.tolerance):
+            self.honored = max(self.honored, asked)
+            if asked >= self.ceiling and self.ceiling < self.maximum:
+                self._fullAtCeiling += 1
+                if self._fullAtCeiling >= self.reprobe:
+                    # The cap may have been a fluke, or twitter may have raised it.
+                    self.ceiling = min(self.maximum, self.ceiling * 2)
+                    self._fullAtCeiling = 0
+            if elapsed < self.slow / 2:
+                self.count = min(self.ceiling, asked * 2)
+        elif self.honored and asked > self.honored:
+            self.ceiling = max(self.minimum, self.honored, got)
+            self.count = self.ceiling
+            self._fullAtCeiling = 0
+
+    @property
+    def tweets_per_request(self) -> float:
+        return self.tweets / self.requests if self.requests else 0.0
+
+    def stats(self) -> dict:
+        return {
+            "count": self.count,
+            "ceiling": self.ceiling,
+            "honored": self.honored,
+            "requests": self.requests,
+            "tweets": self.tweets,
+            "tweets_per_request": self.tweets_per_request,
+        }
 
 
 class TwitterSearch:
@@ -12,11 +159,11 @@ class TwitterSearch:
         :param session_instance:
         """
         if session_instance is None:
-            session_instance = global_instance
+            session_instance = get_global_instance()
         self.session = session_instance
+        # What count="auto" has learned, per search product.
+        self.pageSizes: typing.Dict[str, PageSize] = {}
         self.logging = self.session.logging.getChild("TwitterSearch")
-        self.gravity = HighGravity(self.session)
-        self._routes = None
 
     search_base = {
         # Users
@@ -108,30 +255,120 @@ class TwitterSearch:
 
     @property
     async def routes(self):
-        if not self._routes:
-            self._routes = await self.gravity.retrieve_routes()
-        return self._routes
+        return await self.session.routeRegistry.get()
 
-    async def search(self, query, limit=-1, mode="Top"):
+    async def search(
+        self,
+        query,
+        limit=-1,
+        mode="Top",
+        count: typing.Union[int, str] = 20,
+        prefetch: int = 0,
+        buffer: pipeline.BoundedQueue = None,
+        dedupe: Deduper = None,
+        resume_key: str = None,
+        checkpoints: CheckpointStore = None,
+        watermark: Watermark = None,
+    ):
         """
         Search for tweets with the specified query.
 
         :param query: The query arguments. Anything on Twitter's /search route works.
-        :param limit: Limits then umber of tweets returned. 0 to scrape all.
+        :param limit: Limits the number of tweets returned. 0 or less to scrape all.
+        When resuming, this counts the tweets yielded by earlier runs too.
         :param mode: The type of search to do. Available modes: ["Top", "People", "Photos", "Videos", "Latest"]
+        :param count: The number of tweets to ask for per page. "auto" probes for the largest page size the
+        product honors and backs off on short or slow pages. See page_size(mode).stats() for tweets per request.
+        :param prefetch: How many pages to fetch ahead of the consumer. 0 fetches the next page only once
+        the current one has been consumed.
+        :param buffer: A BoundedQueue of pages to fetch ahead into, instead of prefetch. Its sizer sets what it's
+        bounded by, e.g. BoundedQueue(500, pipeline.tweets) or BoundedQueue(16 * 1024 * 1024, pipeline.footprint).
+        Fetching pauses while it's full. Its stats() show the depth and how long fetching stalled.
+        It can be passed to one search after another, but not to two at once.
+        :param dedupe: Drops tweets it has already seen, such as repeats at page boundaries. None to keep everything.
+        :param resume_key: Checkpoint the search under this key, and pick up where the last run with it stopped.
+        :param checkpoints: Where checkpoints are kept. Defaults to a FileCheckpointStore in the home folder.
+        :param watermark: Only get tweets newer than this. Latest mode only.
+        The watermark is updated in place once the search reaches it, ready for the next run.
         :return: An async generator of tweets.
         """
+        if watermark is not None and mode != "Latest":
+            raise RedGalaxyException(
+                f"Watermarks need a Latest search. {mode} results are not in time order."
+            )
+        checkpoint = None
+        if resume_key is not None:
+            if checkpoints is None:
+                checkpoints = FileCheckpointStore()
+            checkpoint = checkpoints.load(resume_key)
+            if checkpoint is None:
+                checkpoint = Checkpoint(query, mode)
+            elif (checkpoint.query, checkpoint.mode) != (query, mode):
+                raise RedGalaxyException(
+                    f"Checkpoint {resume_key} is for {checkpoint.mode} search {checkpoint.query!r}, not {mode} {query!r}."
+                )
+            else:
+                self.logging.debug(
+                    f"Resuming {resume_key} after {checkpoint.count} tweets."
+                )
+            if checkpoint.done:
+                return
+            if limit > 0:
+                limit -= checkpoint.count
+                if limit <= 0:
+                    return
 
-        count = 20
-
-        routes: dict = await self.routes
-
-        route = routes.get("SearchTimeline")
-        if not route:
-            self.logging.error("Routes list:")
-            self.logging.error(routes)
-            raise Exception("Missing routes?")
+        pages = self.pages(
+            query, mode, count, cursor=checkpoint.cursor if checkpoint else None
+        )
+        if buffer is not None:
+            pages = pipeline.prefetch(pages, queue=buffer)
+        elif prefetch > 0:
+            pages = pipeline.prefetch(pages, prefetch)
+        resuming = checkpoint is not None
+        try:
+            async for entries, cursors in pages:
+                start = 0
+                if resuming:
+                    # The page we stopped in. Skip what was already yielded.
+                    start = checkpoint.resume_at(entries)
+                    resuming = False
+                if checkpoint is not None and start == len(entries):
+                    checkpoint.turn(entries, cursors)
+                    checkpoints.save(resume_key, checkpoint)
+                for idx in range(start, len(entries)):
+                    entry = entries[idx]
+                    if watermark is not None:
+                        if watermark.reached(entry["tweet"].id):
+                            # Everything from here down was fetched by an earlier run.
+                            watermark.advance()
+                            if checkpoint is not None:
+                                checkpoint.done = True
+                            return
+                        watermark.saw(entry["tweet"].id)
+                    fresh = dedupe is None or dedupe.add(entry["tweet"].id)
+                    if checkpoint is not None:
+                        # Recorded before handing it over, the consumer may not come back for the next one.
+                        checkpoint.lastId = entry["tweet"].id
+                        checkpoint.count += fresh
+                        if idx == len(entries) - 1:
+                            # Done with the page. A resume starts from the next one.
+                            checkpoint.turn(entries, cursors)
+                            checkpoints.save(resume_key, checkpoint)
+                    if fresh:
+                        yield entry
+                        limit -= 1
+                    if limit == 0:
+                        return
+            if watermark is not None:
+                watermark.advance()
+        finally:
+            # Close the page walk now rather than whenever it's collected, so a buffer is freed for reuse.
+            await pages.aclose()
+            if checkpoint is not None:
+                checkpoints.save(resume_key, checkpoint)
 
+    def search_args(self, query, mode="Top", count=20, cursor=None) -> dict:
         # args = {
         #     **self.search_base,
         #     "q": query,
@@ -150,12 +387,13 @@ class TwitterSearch:
             "count": count,
             "product": mode,
             "querySource": "spelling_expansion_revert_click",
-            "cursor": None,
             "includePromotedContent": False
             # "withDownvotePerspective": False,
             # "withReactionsMetadata": False,
             # "withReactionsPerspective": False,
         }
+        if cursor is not None:
+            args["cursor"] = cursor
         # referer = "https://twitter.com/search?" + urllib.parse.urlencode(
         #     {
         #         "f": "live",
@@ -164,54 +402,346 @@ class TwitterSearch:
         #         "src": "spelling_expansion_revert_click",
         #     }
         # )
-        while True:
-            param = args.copy()
-            if param["cursor"] is None:
-                del param["cursor"]
+        return args
 
-            timeline, global_objects = await self.get_timeline(
-                param, self.featureFlags, route[0]
-            )
-            args["cursor"] = None
-            # Get Current run Cursors
-            cursor = {"top": None, "bottom": None}
-            run_count = 0
-            for i in UtilBox.iter_timeline_data(
-                timeline, global_objects, limit, cursor
-            ):
-                run_count += 1
-                yield i
+    async def page(self, query, mode="Top", count=20, cursor=None, cache=True):
+        """
+        Requests a single page of search results.
+
+        :param query: The query arguments.
+        :param mode: The type of search to do.
+        :param count: The number of tweets to ask for.
+        :param cursor: The cursor to start from. None for the first page.
+        :param cache: Allow the page to be served from the session's responseCache.
+        :return: A list of tweet entries and the page's {"top", "bottom"} cursors.
+        """
+        timeline, global_objects = await self.get_timeline(
+            self.search_args(query, mode, count, cursor), self.featureFlags, cache=cache
+        )
+        # Get Current run Cursors
+        cursors = {"top": None, "bottom": None}
+        entries = list(
+            UtilBox.iter_timeline_data(timeline, global_objects, -1, cursors)
+        )
+        return entries, cursors
+
+    def page_size(self, mode: str) -> PageSize:
+        """
+        :param mode: The search product.
+        :return: The PageSize count="auto" uses for the product. Its stats() report tweets per request.
+        """
+        if mode not in self.pageSizes:
+            self.pageSizes[mode] = PageSize()
+        return self.pageSizes[mode]
+
+    async def pages(
+        self, query, mode="Top", count: typing.Union[int, str] = 20, cursor=None
+    ):
+        """
+        Walks the search's pages through the bottom cursor until a page comes back empty.
 
-            if limit == 0:
+        :param count: The number of tweets to ask for per page, or "auto" to adapt it. See PageSize.
+        :return: An async generator of (entries, cursors) per page.
+        """
+        sizer = self.page_size(mode) if count == "auto" else None
+        while True:
+            asked = count if sizer is None else sizer.count
+            started = time.monotonic()
+            entries, cursors = await self.page(query, mode, asked, cursor)
+            more = bool(entries and cursors["bottom"])
+            if sizer is not None:
+                sizer.observe(asked, len(entries), time.monotonic() - started, more)
+            self.logging.debug(f"RunCount: {len(entries)} Expecting? {asked}")
+            yield entries, cursors
+            if not more:
                 return
-            self.logging.debug(f"RunCount: {run_count} Expecting? {run_count > 20}")
-            args["cursor"] = cursor["bottom"]["value"]
-            if run_count == 0:
-                break
+            cursor = cursors["bottom"]["value"]
+
+    async def parallel_search(
+        self,
+        query,
+        since: typing.Union[int, datetime.datetime],
+        until: typing.Union[int, datetime.datetime] = None,
+        limit=-1,
+        mode="Latest",
+        windows: int = 8,
+        concurrency: int = 4,
+        sessions: typing.List[SessionManager] = None,
+        split_pages: int = 4,
+        min_window: datetime.timedelta = datetime.timedelta(minutes=10),
+        dedupe: Deduper = None,
+        max_buffered: int = 2000,
+    ):
+        """
+        Searches a time range by walking slices of it at the same time.
+        Tweets come back newest first and de-duplicated, like a single Latest search would return them.
+
+        Windows that turn out to be busy are split further: if the first page of a window only covers a small
+        part of it, the rest is cut into pieces that each take about `split_pages` pages.
+
+        :param query: The query arguments. Anything on Twitter's /search route works.
+        :param since: The oldest tweet id or datetime to search from.
+        :param until: The newest tweet id or datetime to search to. Defaults to now.
+        :param limit: Limits the number of tweets returned. 0 or less to scrape all.
+        :param mode: The type of search to do. Only "Latest" keeps the output in order.
+        :param windows: The number of slices the range starts out in.
+        :param concurrency: The number of pages fetched at the same time.
+        :param sessions: Sessions to spread the slices over. Defaults to this search's session.
+        :param split_pages: Split a window when it looks like it would take more pages than this.
+        :param min_window: Windows shorter than this are never split.
+        :param dedupe: Drops tweets it has already seen. Defaults to a SnowflakeWindowSet,
+        which is enough since tweets come out in order.
+        :param max_buffered: The max number of tweets fetched ahead of the consumer. Once reached, only the
+        window being consumed keeps fetching, so memory and requests stay bounded when the consumer is slow
+        or stops at `limit`.
+        :return: An async generator of tweets.
+        """
+        if until is None:
+            until = datetime.datetime.now(tz=datetime.timezone.utc)
+        lo = UtilBox.as_snowflake(since)
+        hi = UtilBox.as_snowflake(until) - 1
+        if hi <= lo:
+            return
+        searchers = itertools.cycle(
+            [
+                self if session is self.session else TwitterSearch(session)
+                for session in (sessions or [self.session])
+            ]
+        )
+        min_span = int(min_window.total_seconds() * 1000)
+
+        order = itertools.count()
+        pending = []
+        tasks = []
+        # Every page fetch takes a slot. Walkers waiting on the buffer don't hold one,
+        # so the window being consumed can always get going.
+        limiter = asyncio.Semaphore(concurrency)
+        changed = asyncio.Event()
+        room = asyncio.Event()
+        buffered = 0
+        errors = []
+
+        def add(window: SearchWindow):
+            bisect.insort(pending, (-window.hi, next(order), window))
+            tasks.append(asyncio.ensure_future(run(next(searchers), window)))
+
+        def full(window: SearchWindow) -> bool:
+            return buffered >= max_buffered and pending[0][2] is not window
+
+        async def walk(searcher: "TwitterSearch", window: SearchWindow):
+            nonlocal buffered
+            first = True
+            pages = searcher.pages(window.query(query), mode)
+            try:
+                while True:
+                    while full(window):
+                        room.clear()
+                        await room.wait()
+                    async with limiter:
+                        try:
+                            entries, cursors = await pages.__anext__()
+                        except StopAsyncIteration:
+                            return
+                    window.entries.extend(entries)
+                    buffered += len(entries)
+                    changed.set()
+                    ids = [entry["tweet"].id for entry in entries]
+                    if first and ids and window.span > min_span:
+                        covered = max(1, (window.hi >> 22) - (min(ids) >> 22))
+                        estimate = window.span / covered
+                        if estimate > split_pages:
+                            # Dense window. Hand the rest of it out as smaller windows.
+                            pieces = min(16, math.ceil(estimate / split_pages))
+                            self.logging.debug(
+                                f"Splitting {window.lo}-{window.hi} into {pieces}. ~{estimate:.0f} pages."
+                            )
+                            for piece in window.split(min(ids) - 1, pieces):
+                                add(piece)
+                            return
+                    first = False
+            finally:
+                await pages.aclose()
+
+        async def run(searcher: "TwitterSearch", window: SearchWindow):
+            try:
+                await walk(searcher, window)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                errors.append(e)
+            finally:
+                window.done = True
+                changed.set()
+
+        for window in SearchWindow(lo, hi).split(hi, windows):
+            add(window)
+        if dedupe is None:
+            dedupe = SnowflakeWindowSet()
+        try:
+            while pending:
+                if errors:
+                    raise errors[0]
+                head = pending[0][2]
+                if head.entries:
+                    entry = head.entries.popleft()
+                    buffered -= 1
+                    room.set()
+                    if not dedupe.add(entry["tweet"].id):
+                        continue
+                    yield entry
+                    limit -= 1
+                    if limit == 0:
+                        return
+                    continue
+                if head.done:
+                    pending.pop(0)
+                    room.set()
+                    continue
+                changed.clear()
+                await changed.wait()
+            if errors:
+                raise errors[0]
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    @staticmethod
+    def chunk_queries(
+        terms: typing.Iterable[str],
+        template: str = "from:{}",
+        suffix: str = "",
+        max_length: int = 500,
+    ) -> typing.List[str]:
+        """
+        Packs terms into as few "(a OR b OR ...)" queries as fit twitter's query length limit.
+
+        :param terms: The terms to search for. (e.g. usernames)
+        :param template: How each term is written in the query.
+        :param suffix: Added to the end of every query. (e.g. "-filter:replies")
+        :param max_length: The max length of a single query.
+        :return: A list of queries.
+        """
+        joiner = " OR "
+        # "(" + ")" + the suffix and its space.
+        overhead = 2 + (len(suffix) + 1 if suffix else 0)
+        parts = sorted(
+            dict.fromkeys(template.format(term) for term in terms), key=len, reverse=True
+        )
+        # First fit decreasing. Longest terms go first so short ones can fill the gaps.
+        bins: typing.List[typing.List[str]] = []
+        lengths: typing.List[int] = []
+        for part in parts:
+            if overhead + len(part) > max_length:
+                raise RedGalaxyException(
+                    f"{part} does not fit in a query of {max_length} characters."
+                )
+            for idx, length in enumerate(lengths):
+                if length + len(joiner) + len(part) <= max_length:
+                    bins[idx].append(part)
+                    lengths[idx] += len(joiner) + len(part)
+                    break
+            else:
+                bins.append([part])
+                lengths.append(overhead + len(part))
+        return [
+            f"({joiner.join(parts)})" + (f" {suffix}" if suffix else "") for parts in bins
+        ]
+
+    async def search_many(
+        self,
+        terms: typing.Iterable[str],
+        template: str = "from:{}",
+        suffix: str = "",
+        limit=-1,
+        mode="Latest",
+        concurrency: int = 4,
+        max_length: int = 500,
+        dedupe: Deduper = None,
+    ):
+        """
+        Searches for a large list of terms at once, such as thousands of accounts.
+        The terms are packed into as few queries as possible (see chunk_queries), which are run concurrently
+        under the session's rate limits and merged into one de-duplicated stream.
+
+        :param terms: The terms to search for. (e.g. usernames)
+        :param template: How each term is written in the query.
+        :param suffix: Added to the end of every query. (e.g. "-filter:replies")
+        :param limit: Limits the number of tweets returned. 0 or less to scrape all.
+        :param mode: The type of search to do.
+        :param concurrency: The number of queries run at the same time.
+        :param max_length: The max length of a single query.
+        :param dedupe: Drops tweets it has already seen. Defaults to a RotatingBloomFilter,
+        since tweets from different queries arrive out of order.
+        :return: An async generator of tweets, in the order they arrive.
+        """
+        queries = self.chunk_queries(terms, template, suffix, max_length)
+        self.logging.debug(f"Packed terms into {len(queries)} queries.")
+        if not queries:
+            return
+        limiter = asyncio.Semaphore(concurrency)
+        merged = asyncio.Queue(maxsize=concurrency * 20)
+        finished = object()
+
+        async def run(query):
+            # No put in a finally. Once cancelled, the consumer is gone and a full queue would never drain.
+            try:
+                async with limiter:
+                    async for entry in self.search(query, mode=mode):
+                        await merged.put(entry)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                await merged.put(e)
+            await merged.put(finished)
+
+        tasks = [asyncio.ensure_future(run(query)) for query in queries]
+        running = len(tasks)
+        if dedupe is None:
+            dedupe = RotatingBloomFilter()
+        try:
+            while running:
+                entry = await merged.get()
+                if entry is finished:
+                    running -= 1
+                    continue
+                if isinstance(entry, Exception):
+                    raise entry
+                if not dedupe.add(entry["tweet"].id):
+                    continue
+                yield entry
+                limit -= 1
+                if limit == 0:
+                    return
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
 
-    async def get_timeline(self, param: dict, features: dict, graphql_url):
+    async def get_timeline(
+        self,
+        param: dict,
+        features: dict,
+        operation: str = "SearchTimeline",
+        cache: bool = True,
+    ):
         tries = 5
         adapted = None
         while tries > 0:
-            adapted = await self.session.get(
-                graphql_url,
-                params={
-                    "variables": json.dumps(param).replace(" ", ""),
-                    "features": json.dumps(features).replace(" ", ""),
-                },
-            )
+            adapted = await self.session.graphql(operation, param, features, cache=cache)
             # Twitter may not return a rate limit remaining in the header.
-            # In this case, assume that the request was successful and re-get tokens
-
+            # In this case, assume that the token is bad and drop it from the pool.
+            token = adapted.request.headers.get("x-guest-token")
             if adapted.headers.get("x-rate-limit-remaining", 0) == 0:
-                await self.session.ensure_token(retry=True)
+                self.session.tokenManager.discard(token)
                 tries -= 1
                 continue
             if adapted.status_code == 503:
                 tries -= 1
                 continue
             if adapted.status_code == 429:
-                await self.session.ensure_token(retry=True)
+                # The rate limiter has benched the token for this route. The next try picks another one,
+                # or swaps in a fresh token if every pooled one is spent for a while.
                 tries -= 1
                 continue
             if adapted.status_code != 200:
@@ -223,7 +753,7 @@ class TwitterSearch:
                 break
         if adapted is None:
             raise RedGalaxyException("Gave up Trying.")
-        j_data: dict = adapted.json()
+        j_data: dict = self.session.decode(adapted)
         self.logging.debug(f"Response: {j_data}")
         content = (
             j_data.get("data", {})
@@ -241,76 +771,94 @@ class TwitterSearch:
         self,
         query,
         limit=-1,
-        mode="top",
+        mode="Latest",
         initial_track: bool = False,
         refresh_rate: float = 30.0,
+        min_refresh: float = 5.0,
+        max_refresh: float = 120.0,
+        max_backtrack: int = 10,
+        count: int = 20,
+        dedupe: Deduper = None,
     ):
         """
         Stream a list of tweets from with a query.
 
-        Note: This stream does not backtrack when it reaches a max number of 20 tweets.
+        Each poll follows the top cursor. If a poll comes back with a full page that doesn't reach
+        the last tweet we've seen, more than a page arrived since the last poll, so the stream
+        backtracks through bottom cursors until it reconnects with that tweet.
 
-        TODO: Allow backtracking eventually. It is possible to backtrack, but it probably needs tweet counting.
+        The poll interval adapts to how fast tweets arrive, aiming for about half a page per poll.
 
         :param query: The query term to be placed in the search
-        :param limit: The max number of tweets to be retrieved before exiting.
-        :param mode: The type of search to do. Can be: ["live", "top", "user", "image", "video"]
-        :param refresh_rate: How often new tweets should be fetched? Defaults to 5 seconds.
+        :param limit: The max number of tweets to be retrieved before exiting. 0 or less to stream forever.
+        :param mode: The type of search to do. Should be "Latest" for a live stream.
+        :param refresh_rate: The poll interval to start with, in seconds.
+        :param min_refresh: The shortest the poll interval can get, in seconds.
+        :param max_refresh: The longest the poll interval can get, in seconds.
+        :param max_backtrack: The max number of pages to backtrack through after an overflow.
+        :param count: The number of tweets to ask for per poll.
+        :param dedupe: Drops tweets it has already seen. Defaults to a SnowflakeWindowSet,
+        so memory stays bounded however long the stream runs.
         :param initial_track: Do we retrieve the initial first 20 tweets?
-        :return:
+        :return: An async generator of tweets, oldest first.
         """
+        # Polls repeat the same cursor until something new arrives, so they can't be cached.
+        entries, cursors = await self.page(query, mode, count, cache=False)
+        top = cursors["top"]["value"] if cursors["top"] else None
+        last_seen = max((entry["tweet"].id for entry in entries), default=0)
+        if dedupe is None:
+            dedupe = SnowflakeWindowSet()
+        batch = entries if initial_track else []
+        interval = refresh_rate
+        polled = time.monotonic()
+        while True:
+            for entry in sorted(batch, key=lambda entry: entry["tweet"].id):
+                if not dedupe.add(entry["tweet"].id):
+                    continue
+                yield entry
+                limit -= 1
+                if limit == 0:
+                    return
 
-        raise NotImplementedError("TBD once Search has been reimplemented.")
-        count = 20
+            await asyncio.sleep(interval)
+            entries, cursors = await self.page(query, mode, count, top, cache=False)
+            if cursors["top"]:
+                top = cursors["top"]["value"]
+            batch = [entry for entry in entries if entry["tweet"].id > last_seen]
 
-        args = {
-            **self.search_base,
-            "q": query,
-            "tweet_search_mode": mode,
-            "count": count,
-            "query_source": "spelling_expansion_revert_click",
-            "cursor": None,
-            "pc": "1",
-            "spelling_corrections": 1,
-            "include_ext_edit_control": "true",
-            "ext": "mediaStats,highlightedLabel,hasNftAvatar,voiceInfo,enrichments,"
-            "superFollowMetadata,unmentionInfo,editControl,collab_control,vibe",
-        }
-        initial_track = not initial_track  # Just invert it lol
-        while True:
-            param = args.copy()
-            if param["cursor"] is None:
-                del param["cursor"]
-
-            timeline, global_objects = await self.get_timeline(param)
-            args["cursor"] = None
-            # Get Current run Cursors
-            cursor = {"top": None, "bottom": None}
-
-            for i in timeline.get("instructions"):
-                if list(i.keys())[0] == "addEntries":
-                    # Bottom to top.
-                    reverse = list(reversed(i["addEntries"]["entries"]))
-                    for entry in self.iter_entries(reverse, global_objects):
-                        if entry.get("type") == "cursor":
-                            cursor[entry["direction"]] = entry
-                        else:
-                            if initial_track:
-                                continue
-                            yield entry
-                            if limit >= 0:
-                                limit -= 1
-                            if limit == 0:
-                                break
-                elif list(i.keys())[0] == "replaceEntry":
-                    for entry in self.iter_entries(
-                        i["addEntries"]["entries"], global_objects
-                    ):
-                        if entry.get("type") == "cursor":
-                            cursor[entry["direction"]] = entry
-            if initial_track:
-                initial_track = False
-            if limit == 0:
-                return
-            args["cursor"] = cursor["top"]["value"]
-            await asyncio.sleep(refresh_rate)
+            # A full page of only new tweets means we've fallen behind. Walk back to the last one we saw.
+            backtrack = cursors["bottom"]
+            pages = 0
+            while (
+                last_seen
+                and len(entries) >= count
+                and min(entry["tweet"].id for entry in entries) > last_seen
+                and backtrack
+                and pages < max_backtrack
+            ):
+                pages += 1
+                entries, cursors = await self.page(
+                    query, mode, count, backtrack["value"], cache=False
+                )
+                batch.extend(entry for entry in entries if entry["tweet"].id > last_seen)
+                backtrack = cursors["bottom"]
+                if not entries:
+                    break
+            if pages:
+                self.logging.debug(f"Backtracked {pages} pages. Got {len(batch)} tweets.")
+                if pages >= max_backtrack:
+                    self.logging.warning(
+                        f"Stream fell behind by more than {max_backtrack} pages. Tweets may be missing."
+                    )
+
+            # Adapt the interval to the arrival rate.
+            now = time.monotonic()
+            rate = len(batch) / max(now - polled, 1e-3)
+            polled = now
+            if rate > 0:
+                interval = (count / 2) / rate
+            else:
+                interval *= 1.5
+            interval = min(max_refresh, max(min_refresh, interval))
+            if batch:
+                last_seen = max(last_seen, *(entry["tweet"].id for entry in batch))
@@ -1,15 +1,22 @@
 import asyncio
 import base64
+import contextlib
 import enum
+import importlib.util
 import json
 import logging
 import pathlib
 import random
+import typing
+import urllib.parse
 
 import httpx
 import time
 
 from .exceptions import RedGalaxyException, SessionManagerException
+from .cache import ResponseCache
+from .ratelimit import RateLimiter
+from .routes import RouteRegistry
 
 # Nitter's Bear token. A bit old, but it works as of 03/02/2023
 _DEFAULT_BEARER = "AAAAAAAAAAAAAAAAAAAAAPYXBAAAAAAACLXUNDekMxqa8h%2F40K4moUkGsoc%3DTYfbDKbT3jJPCEVnMYqilB28NHfOPqkca3qaAxGfsyKCs0wRbw"
@@ -17,48 +24,222 @@ _DEFAULT_BEARER = "AAAAAAAAAAAAAAAAAAAAAPYXBAAAAAAACLXUNDekMxqa8h%2F40K4moUkGsoc
 # _DEFAULT_BEARER = "AAAAAAAAAAAAAAAAAAAAANRILgAAAAAAnNwIzUejRCOuH5E6I8xnZz4puTs%3D1Zv7ttfk8LF81IUq16cHjhLTvJu4FA33AGWWjCpTnA"
 
 
+# Generous read timeout. SearchTimeline pages can be slow to come back.
+_DEFAULT_TIMEOUT = httpx.Timeout(connect=10.0, read=30.0, write=10.0, pool=10.0)
+
+# Only probed for. httpx imports h2 itself when http2 is used.
+_HAS_H2 = importlib.util.find_spec("h2") is not None
+
+# The hosts the guest token cookie and twitter's jar cookies are sent to. Bundles and media live elsewhere.
+_COOKIE_HOSTS = {"twitter.com", "api.twitter.com"}
+
+
+def _cookie_matches(domain: str, host: str) -> bool:
+    # Same rule as the cookie jar: an exact match, or a dotted parent domain.
+    domain = domain.lstrip(".")
+    return host == domain or host.endswith("." + domain)
+
+# Responses are decoded straight from bytes with the fastest parser available.
+try:
+    from orjson import loads
+except ImportError:
+    try:
+        from msgspec.json import decode as loads
+    except ImportError:
+        loads = json.loads
+
+
 class SessionMode(enum.IntEnum):
     BEARER = 1
     CONSUMER = 2
 
 
+class GuestToken:
+    def __init__(self, value: str, setTime: float = None):
+        """
+        A single guest token. Its rate limits are per route and kept by the RateLimiter.
+
+        :param value: The guest token.
+        :param setTime: When the token was activated. Defaults to now.
+        """
+        self.value = value
+        self.setTime = time.time() if setTime is None else setTime
+        self.uses = 0
+
+    @property
+    def expired(self):
+        return self.setTime < time.time() - TokenManager.ttl
+
+    def to_dict(self):
+        return {"tk": self.value, "st": self.setTime}
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        return cls(data.get("tk"), data.get("st", 0))
+
+
 class TokenManager:
-    def __init__(self, cacheFolder: pathlib.Path = pathlib.Path.home()):
+    ttl = 10800
+
+    def __init__(
+        self,
+        cacheFolder: pathlib.Path = pathlib.Path.home(),
+        poolSize: int = 1,
+        strategy: str = "round-robin",
+    ):
+        """
+        Keeps a pool of guest tokens and hands them out to requests.
+
+        :param cacheFolder: The folder where ".redgalaxy/guest-token.json" is kept.
+        :param poolSize: The number of guest tokens to keep active.
+        :param strategy: How tokens are picked. Either "round-robin" or "least-used".
+        """
+        if strategy not in ("round-robin", "least-used"):
+            raise SessionManagerException(
+                "Strategy undefined. Either: round-robin or least-used."
+            )
         self.cacheFile = cacheFolder.resolve() / ".redgalaxy" / "guest-token.json"
-        self._token = None
-        self._setTime = 0
+        self.poolSize = max(1, poolSize)
+        self.strategy = strategy
+        self.tokens: typing.List[GuestToken] = []
+        self._cursor = 0
+        self._loaded = False
 
     def read(self):
+        self._loaded = True
         if self.cacheFile.exists():
             cached = json.loads(self.cacheFile.read_text(encoding="utf-8"))
-            self._token = cached.get("tk")
-            self._setTime = cached.get("st", 0)
+            if "tokens" in cached:
+                tokens = [GuestToken.from_dict(tk) for tk in cached["tokens"]]
+            else:
+                # Single token cache from older versions.
+                tokens = [GuestToken(cached.get("tk"), cached.get("st", 0))]
+            self.tokens = [
+                tk for tk in tokens if tk.value and not tk.expired
+            ][-self.poolSize :]
+
+    def write(self):
+        self.cacheFile.parent.mkdir(parents=True, exist_ok=True)
+        self.cacheFile.write_text(
+            json.dumps({"tokens": [tk.to_dict() for tk in self.tokens]})
+        )
 
     @property
-    def token(self):
-        if self._setTime < time.time() - 10800:
-            # Expired, but don't unset.
-            return None
-        if not self._token:
+    def live(self) -> typing.List[GuestToken]:
+        if not self._loaded:
             self.read()
-        return self._token
+        self.tokens = [tk for tk in self.tokens if not tk.expired]
+        return self.tokens
+
+    @property
+    def vacant(self):
+        """
+        :return: True if the pool has room for another token.
+        """
+        return len(self.live) < self.poolSize
+
+    def candidates(self) -> typing.List[GuestToken]:
+        """
+        :return: Usable tokens in the order they should be tried.
+        """
+        tokens = self.live
+        if not tokens:
+            return []
+        if self.strategy == "least-used":
+            return sorted(tokens, key=lambda tk: tk.uses)
+        start = self._cursor % len(tokens)
+        return tokens[start:] + tokens[:start]
+
+    def acquire(
+        self, usable: typing.Callable[[GuestToken], bool] = None
+    ) -> typing.Optional[GuestToken]:
+        """
+        Picks a token for a request.
+
+        :param usable: Prefer tokens this returns True for. Falls back to the usual pick if none are.
+        :return: A GuestToken or None if every token is expired.
+        """
+        tokens = self.candidates()
+        if not tokens:
+            return None
+        if usable:
+            tokens = [tk for tk in tokens if usable(tk)] or tokens
+        self._cursor += 1
+        tokens[0].uses += 1
+        return tokens[0]
+
+    def find(self, value) -> typing.Optional[GuestToken]:
+        for tk in self.tokens:
+            if tk.value == value:
+                return tk
+        return None
+
+    def add(self, value):
+        """
+        Adds a freshly activated token, evicting the oldest tokens if the pool is full.
+
+        :param value: The guest token.
+        """
+        tokens = self.live
+        while len(tokens) >= self.poolSize:
+            tokens.pop(0)
+        tokens.append(GuestToken(value))
+        self.write()
+
+    def discard(self, value):
+        tk = self.find(value)
+        if tk:
+            self.tokens.remove(tk)
+            self.write()
+
+    @property
+    def token(self):
+        tk = self.acquire()
+        return tk.value if tk else None
 
     @token.setter
     def token(self, value):
-        self._token = value
-        self._setTime = time.time()
-        self.cacheFile.parent.mkdir(parents=True, exist_ok=True)
-        self.cacheFile.write_text(json.dumps({"tk": self._token, "st": self._setTime}))
+        self.add(value)
 
 
 class SessionManager:
+    # Replace a token spent on a route rather than wait longer than this for its reset, in seconds.
+    swap_after = 60
+    # After a failed activation, optional activations wait this long, doubling per failure up to the max.
+    activation_backoff = 5
+    activation_backoff_max = 300
+
     def __init__(
         self,
         mode: SessionMode,
         key=None,
         secret=None,
         tokenManager: TokenManager = None,
+        poolSize: int = 1,
+        rateLimiter: RateLimiter = None,
+        maxConnections: int = 100,
+        maxKeepalive: int = 20,
+        keepaliveExpiry: float = 30.0,
+        http2: bool = None,
+        timeout: httpx.Timeout = None,
+        responseCache: ResponseCache = None,
     ):
+        """
+        Manages auth, guest tokens and the http client used by every route.
+
+        :param mode: Either SessionMode.BEARER or SessionMode.CONSUMER.
+        :param key: The bearer token or consumer key.
+        :param secret: The consumer secret.
+        :param tokenManager: A TokenManager instance. If none is provided, one is created with poolSize tokens.
+        :param poolSize: The number of guest tokens to rotate between.
+        :param rateLimiter: A RateLimiter instance. If none is provided, a bursting one is created.
+        :param maxConnections: The max number of open connections in the client's pool.
+        :param maxKeepalive: The max number of idle connections kept alive.
+        :param keepaliveExpiry: How long an idle connection is kept alive for, in seconds.
+        :param http2: Use HTTP/2. Defaults to True if the optional h2 package is installed.
+        :param timeout: A httpx.Timeout. Defaults to _DEFAULT_TIMEOUT.
+        :param responseCache: A ResponseCache for graphql responses. None to always go to twitter.
+        """
         if mode == SessionMode.BEARER:
             self.consumer = None
             self.access_token = key
@@ -71,89 +252,317 @@ class SessionManager:
             self.auth = None
         else:
             raise SessionManagerException("Mode undefined. Either: BEARER or CONSUMER.")
-        self.headers = None
-        self.tokenManager = TokenManager() if not tokenManager else tokenManager
-        self._session = httpx.AsyncClient()
+        self.tokenManager = (
+            TokenManager(poolSize=poolSize) if not tokenManager else tokenManager
+        )
+        self.rateLimiter = RateLimiter() if not rateLimiter else rateLimiter
+        if http2 is None:
+            http2 = _HAS_H2
+        elif http2 and not _HAS_H2:
+            raise SessionManagerException(
+                "HTTP/2 requires the h2 package. Install with: pip install httpx[http2]"
+            )
+        self.limits = httpx.Limits(
+            max_connections=maxConnections,
+            max_keepalive_connections=maxKeepalive,
+            keepalive_expiry=keepaliveExpiry,
+        )
+        self.http2 = http2
+        self._session = httpx.AsyncClient(
+            limits=self.limits,
+            http2=http2,
+            timeout=_DEFAULT_TIMEOUT if timeout is None else timeout,
+        )
+        self._inflight = 0
+        self._peakInflight = 0
+        self._activation: typing.Optional[asyncio.Future] = None
+        self._activationFailures = 0
+        self._activationRetry = 0.0
+        self.routeRegistry = RouteRegistry(self)
+        self.responseCache = responseCache
         self.logging = logging.getLogger("SessionManager")
 
-    async def do_headers(self, referer, set_auth=True):
-        self.logging.debug(f"Writing Headers, set_auth: {set_auth}, referer: {referer}")
+    def base_headers(self, referer, set_auth=True) -> dict:
+        """
+        Builds a fresh set of headers for a single request.
+        Nothing here touches the shared client, so concurrent requests can't clobber each other.
 
+        :param referer: The referer to send.
+        :param set_auth: Include the Authorization header.
+        :return: A new header dict.
+        """
         if self.auth is None and not self.is_bearer:
             raise RedGalaxyException(
                 "Non-Bearer tokens needs to be initalized seperately before calling any function."
             )
             # await self.get_access_token()
-        self.headers = {
+        headers = {
             "User-Agent": f"Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
             f"Chrome/109.0.0.0 Safari/537.{random.randint(0, 99)}",
-            "Authorization": self.auth,
             "Referer": referer,
             "Accept-Language": "en-US,en;q=0.5",
         }
-        if not set_auth:
-            del self.headers["Authorization"]
+        if set_auth:
+            headers["Authorization"] = self.auth
+        return headers
+
+    async def do_headers(
+        self, referer, set_auth=True, guest_token=True, route: str = None, url=None
+    ) -> dict:
+        """
+        Builds the headers for a single request, including a guest token from the pool.
 
-        if self._session:
-            self._session.headers.clear()
-            self._session.headers.update(self.headers)
+        :param referer: The referer to send.
+        :param set_auth: Include the Authorization header.
+        :param guest_token: Include a guest token. Only applies when set_auth is True.
+        :param route: The route key the headers are for. Used to pick a token with budget left.
+        :param url: The url the headers are for. Cookies are only sent to twitter's own hosts.
+        :return: A new header dict.
+        """
+        self.logging.debug(f"Writing Headers, set_auth: {set_auth}, referer: {referer}")
+        headers = self.base_headers(referer, set_auth)
 
         # I'm personally not sure, 06/05/23 twitter seems to break if you try to get with bearer token?
-        if set_auth:
+        if set_auth and guest_token:
             # Ensure we have Guest Token
-            await self.ensure_token()
-            self.headers = {
-                **self.headers,
-                "x-guest-token": self.tokenManager.token,
-                # "x-twitter-active-user": "yes",
-            }
-        # self._session.cookies.clear()
-        self._session.cookies.set("gt", self.tokenManager.token, domain=".twitter.com")
-        self._session.headers.update(self.headers)
-        return self.headers
-
-    async def ensure_token(self, retry=False):  # Taken from snscrape
-        if not self.tokenManager.token or retry:
-            self.logging.debug("Requesting guest token")
-            uri = "https://api.twitter.com/1.1/guest/activate.json"
-            self.logging.debug(f"{self.headers}, {uri}")
-            response = await self._session.post(
-                uri,
-                data=b"",
-                headers=self.headers,
+            token = await self.ensure_token(route=route)
+            headers["x-guest-token"] = token
+            # "x-twitter-active-user": "yes",
+            host = urllib.parse.urlsplit(str(url)).hostname if url else None
+            if host in _COOKIE_HOSTS:
+                # The gt cookie goes with the request rather than into the shared cookie jar.
+                cookies = [
+                    f"{cookie.name}={cookie.value}"
+                    for cookie in self._session.cookies.jar
+                    if cookie.name != "gt" and _cookie_matches(cookie.domain, host)
+                ]
+                headers["Cookie"] = "; ".join([f"gt={token}", *cookies])
+        return headers
+
+    async def ensure_token(self, retry=False, route: str = None):  # Taken from snscrape
+        """
+        Picks a guest token from the pool, activating a new one if the pool has room
+        or every token is spent on the route for longer than swap_after.
+        Only one activation is in flight per session. Everyone else waits on it.
+        After a failed activation, those optional activations back off. See activation_backoff.
+
+        :param retry: Forces a new token to be activated.
+        :param route: Prefer a token that still has rate limit budget for this route.
+        :return: The guest token to use.
+        """
+        candidates = self.tokenManager.candidates()
+        if retry or not candidates:
+            await self.activate_token()
+        elif time.time() < self._activationRetry:
+            # The last activation failed. Make do with the tokens we have until the backoff passes.
+            pass
+        elif route is not None and not any(
+            self.rateLimiter.available(route, tk.value) for tk in candidates
+        ):
+            # Every token we have is spent on this route.
+            waits = {tk.value: self.rateLimiter.wait_time(route, tk.value) for tk in candidates}
+            if self.tokenManager.vacant:
+                await self.activate_token()
+            elif min(waits.values()) > self.swap_after:
+                # The pool is full and the reset is far off. A fresh token beats waiting.
+                self.tokenManager.discard(max(waits, key=waits.get))
+                await self.activate_token()
+        elif self.tokenManager.vacant and self._activation is None:
+            # We still have a usable token, so fill the pool in the background.
+            self._activation = asyncio.ensure_future(self._activate_token())
+            self._activation.add_done_callback(self._activation_done)
+        if route is None:
+            return self.tokenManager.token
+        token = self.tokenManager.acquire(
+            lambda tk: self.rateLimiter.available(route, tk.value)
+        )
+        return token.value if token else None
+
+    async def activate_token(self):
+        """
+        Activates a guest token. Concurrent callers share the same activation.
+
+        :return: The activated guest token.
+        """
+        if self._activation is None:
+            self._activation = asyncio.ensure_future(self._activate_token())
+            self._activation.add_done_callback(self._activation_done)
+        # Shielded so one cancelled waiter doesn't cancel the activation for the rest.
+        return await asyncio.shield(self._activation)
+
+    def _activation_done(self, task: asyncio.Future):
+        if self._activation is task:
+            self._activation = None
+        if task.cancelled():
+            return
+        if task.exception():
+            self._activationFailures += 1
+            backoff = min(
+                self.activation_backoff * 2 ** (self._activationFailures - 1),
+                self.activation_backoff_max,
             )
-            if response.status_code == 200:
-                self.tokenManager.token = json.loads(response.text)["guest_token"]
-            else:
-                response.raise_for_status()  # Oh no
-        return self.tokenManager.token
+            self._activationRetry = time.time() + backoff
+            self.logging.warning(
+                f"Guest token activation failed: {task.exception()!r}. Backing off for {backoff}s."
+            )
+        else:
+            self._activationFailures = 0
+            self._activationRetry = 0.0
+
+    async def _activate_token(self):
+        self.logging.debug("Requesting guest token")
+        uri = "https://api.twitter.com/1.1/guest/activate.json"
+        headers = self.base_headers("https://twitter.com/")
+        self.logging.debug(f"{headers}, {uri}")
+        response = await self._session.post(
+            uri,
+            data=b"",
+            headers=headers,
+        )
+        if response.status_code == 200:
+            token = loads(response.content)["guest_token"]
+            self.tokenManager.token = token
+            return token
+        else:
+            response.raise_for_status()  # Oh no
 
     @property
     def session(self):
-        if self.headers:
-            self._session.headers.update(self.headers)
         return self._session
 
+    @staticmethod
+    def decode(response: httpx.Response):
+        """
+        Decodes a json response. Skips decoding the body to text when orjson or msgspec is installed.
+
+        :param response: The httpx.Response.
+        :return: The decoded json.
+        """
+        return loads(response.content)
+
+    def pool_stats(self) -> dict:
+        """
+        Reports how busy the connection pool is, for sizing maxConnections/maxKeepalive.
+
+        :return: A dict of the configured limits, requests in flight and open connections.
+        """
+        stats = {
+            "http2": self.http2,
+            "max_connections": self.limits.max_connections,
+            "max_keepalive": self.limits.max_keepalive_connections,
+            "inflight": self._inflight,
+            "peak_inflight": self._peakInflight,
+        }
+        # httpx doesn't expose its pool, so this is best effort against httpcore.
+        pool = getattr(getattr(self._session, "_transport", None), "_pool", None)
+        connections = getattr(pool, "connections", None)
+        if connections is not None:
+            stats["connections"] = len(connections)
+            stats["idle"] = sum(1 for conn in connections if conn.is_idle())
+            stats["active"] = stats["connections"] - stats["idle"]
+        return stats
+
     async def get(
         self,
         url,
         referer="https://twitter.com/",
         set_auth=True,
+        guest_token=True,
+        **kwargs,
+    ):
+
+        await self.get_access_token()
+        route = self.rateLimiter.route_name(url)
+        headers = await self.do_headers(referer, set_auth, guest_token, route, url)
+        return await self.request("GET", url, headers=headers, **kwargs)
+
+    async def graphql(
+        self,
+        operation: str,
+        variables: dict,
+        features: dict,
+        rewrite: bool = False,
+        cache: bool = True,
+        **kwargs,
+    ) -> httpx.Response:
+        """
+        Sends a request to a graphql route by its operation name.
+        If twitter has rotated the route's queryId, the route table is refreshed and the request retried once.
+
+        :param operation: The route's operation name. (e.g. SearchTimeline)
+        :param variables: The route's variables.
+        :param features: The feature flags to send.
+        :param rewrite: Send the request through twitter.com/i/api instead of api.twitter.com.
+        :param cache: Use the session's responseCache, if it has one. False for requests that must be live, like polls.
+        :return: The httpx.Response.
+        """
+        key = None
+        if cache and self.responseCache is not None:
+            key = self.responseCache.key(operation, variables, features)
+            cached = self.responseCache.get(key)
+            if cached is not None:
+                self.logging.debug(f"{operation} served from cache.")
+                return cached
+        for attempt in range(2):
+            template = await self.routeRegistry.template(operation, features, rewrite)
+            response = await self.get(
+                template.url,
+                params=template.params(variables),
+                mixin_headers=template.headers,
+                **kwargs,
+            )
+            if attempt or not self.routeRegistry.stale_response(response):
+                break
+            routes = await self.routeRegistry.invalidate(operation, template.source)
+            if routes.get(operation, [None])[0] == template.source:
+                # The url didn't change, so retrying would fail the same way.
+                break
+        if key is not None:
+            self.responseCache.put(key, operation, response)
+        return response
+
+    @contextlib.asynccontextmanager
+    async def stream(
+        self,
+        method,
+        url,
+        referer="https://twitter.com/",
+        set_auth=True,
+        guest_token=True,
         **kwargs,
     ):
+        """
+        Like get/post, but the body is streamed instead of read into memory.
 
+        :return: An async context manager for a httpx.Response.
+        """
         await self.get_access_token()
-        await self.do_headers(referer, set_auth)
-        return await self.request("GET", url, **kwargs)
-
-    async def request(self, method, url, **kwargs):
-        session = self.session
-        headers = {**session.headers, **kwargs.get("mixin_headers", {})}
-        if kwargs.get("mixin_headers", {}):
-            del kwargs["mixin_headers"]
-        kwargs["headers"] = headers
+        route = self.rateLimiter.route_name(url)
+        headers = await self.do_headers(referer, set_auth, guest_token, route, url)
+        headers = {**headers, **kwargs.pop("mixin_headers", {})}
+        token = headers.get("x-guest-token")
+        await self.rateLimiter.acquire(route, token)
+        resp = None
+        try:
+            async with self.session.stream(method, url, headers=headers, **kwargs) as resp:
+                yield resp
+        finally:
+            self.rateLimiter.release(route, token, resp)
+
+    async def request(self, method, url, headers: dict = None, **kwargs):
+        headers = {**(headers or {}), **kwargs.pop("mixin_headers", {})}
         self.logging.debug(f"{method.title()} {url} headers: {headers}, {kwargs}")
-        resp = await session.request(method, url, **kwargs)
+        route = self.rateLimiter.route_name(url)
+        token = headers.get("x-guest-token")
+        await self.rateLimiter.acquire(route, token)
+        resp = None
+        self._inflight += 1
+        self._peakInflight = max(self._peakInflight, self._inflight)
+        try:
+            resp = await self.session.request(method, url, headers=headers, **kwargs)
+        finally:
+            self._inflight -= 1
+            self.rateLimiter.release(route, token, resp)
         return resp
 
     async def post(
@@ -162,12 +571,14 @@ class SessionManager:
         referer="https://twitter.com/",
         set_auth=True,
         skip_access_check=False,
+        guest_token=True,
         **kwargs,
     ):
         if not skip_access_check:
             await self.get_access_token()
-        await self.do_headers(referer, set_auth)
-        return await self.request("POST", url, **kwargs)
+        route = self.rateLimiter.route_name(url)
+        headers = await self.do_headers(referer, set_auth, guest_token, route, url)
+        return await self.request("POST", url, headers=headers, **kwargs)
 
     async def get_access_token(self):
         if self.access_token:
@@ -206,6 +617,11 @@ class SessionManager:
             )
 
     def __del__(self):
+        try:
+            self.routeRegistry.stop()
+        except Exception:
+            # The scheduler's loop may already be closed.
+            pass
         try:
             loop = asyncio.get_event_loop()
             loop.create_task(self.session.aclose())
@@ -214,4 +630,24 @@ class SessionManager:
             loop.run_until_complete(self.session.aclose())
 
 
-global_instance = SessionManager(SessionMode.BEARER, _DEFAULT_BEARER)
+_global_instance: typing.Optional[SessionManager] = None
+
+
+def get_global_instance() -> SessionManager:
+    """
+    Returns the default bearer session, creating it on first use.
+    Nothing is created at import time so importing RedGalaxy stays cheap.
+
+    :return: The shared default SessionManager.
+    """
+    global _global_instance
+    if _global_instance is None:
+        _global_instance = SessionManager(SessionMode.BEARER, _DEFAULT_BEARER)
+    return _global_instance
+
+
+def __getattr__(name):
+    # Keeps `from RedGalaxy.session import global_instance` working.
+    if name == "global_instance":
+        return get_global_instance()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,7 +1,7 @@
 import asyncio
 import typing
 
-from . import global_instance, SessionManager, UtilBox, HighGravity
+from . import get_global_instance, SessionManager, UtilBox, HighGravity
 
 
 class TwitterSpaces:
@@ -11,7 +11,7 @@ class TwitterSpaces:
         :param session_instance:
         """
         if session_instance is None:
-            session_instance = global_instance
+            session_instance = get_global_instance()
         self.session = session_instance
         self.gravity = HighGravity(self.session)
 
@@ -1,12 +1,10 @@
-import json
 import logging
 import typing
 
 from . import (
     RedGalaxyException,
-    global_instance,
+    get_global_instance,
     SessionManager,
-    HighGravity,
     User,
     UtilBox,
     UploadMedia,
@@ -22,10 +20,8 @@ class TwitterUser:
         :param sessionInstance:
         """
         if sessionInstance is None:
-            sessionInstance = global_instance
+            sessionInstance = get_global_instance()
         self.session = sessionInstance
-        self.gravity = HighGravity(self.session)
-        self._routes = []
         self.logging = logging.getLogger("TwitterUser")
         # I'm not sure if we are going to use a custom bearer in the future...
         self.bearer = ""
@@ -43,9 +39,7 @@ class TwitterUser:
 
     @property
     async def routes(self):
-        if not self._routes:
-            self._routes = await self.gravity.retrieve_routes()
-        return self._routes
+        return await self.session.routeRegistry.get()
 
     async def get_user(self, username: typing.Union[str, User]):
         """
@@ -53,8 +47,6 @@ class TwitterUser:
         :param username: The user's username. (e.g. Twitter)
         :return: A User object containing the user's information.
         """
-        routes = await self.routes
-
         if isinstance(username, User):
             username = username.username
             if username is None:
@@ -65,34 +57,14 @@ class TwitterUser:
             "withSafetyModeUserFields": False,
             "withSuperFollowsUserFields": True,
         }
-        route = routes.get("UserByScreenName")
-        if not route:
-            print("Routes list:")
-            print(routes)
-            raise Exception("Missing routes?")
-        url = route[0]
-
-        # Twitter raises an error if we have a missing feature not present in the list.
-        # We could just look at the defaults but at the same time,
-        # it would be better to not follow blindly.
-        set_features = list(self.getUserFeatures.keys())
-        for feature in route[1]["featureSwitches"]:
-            if feature not in set_features:
-                self.logging.warning(
-                    f"!! {feature} found in featureSwitch but missing in setFeatures."
-                )
-        a = await self.session.get(
-            url,
-            params={
-                "variables": json.dumps(variables).replace(" ", ""),
-                "features": json.dumps(self.getUserFeatures).replace(" ", ""),
-            },
+        a = await self.session.graphql(
+            "UserByScreenName", variables, self.getUserFeatures
         )
         if a.status_code != 200:
             self.logging.debug(a.content)
             raise RedGalaxyException(f"Expected 200. Got {a.status_code}")
         # print(a)
-        data: dict = a.json()
+        data: dict = self.session.decode(a)
         true_user = data["data"]["user"]["result"]["legacy"]
         true_user["id"] = data["data"]["user"]["result"]["rest_id"]
         return UtilBox.make_user(true_user)
@@ -122,43 +94,17 @@ class TwitterUser:
                 raise Exception(f"{user_id} is not a int or User object.")
 
             user_id_str.append(str(uid))
-        routes = await self.routes
 
         variables = {
             "userIds": user_id_str,
             "withSafetyModeUserFields": False,
         }
 
-        route = routes.get("UsersByRestIds")
-        if not route:
-            print("Routes list:")
-            print(routes)
-            raise Exception("Missing routes?")
-        url = route[0]
-
-        # Twitter raises an error if we have a missing feature not present in the list.
-        # We could just look at the defaults but at the same time,
-        # it would be better to not follow blindly.
-        features = self.getUserIdFeatures
-        set_features = list(features.keys())
-        for feature in route[1]["featureSwitches"]:
-            if feature not in set_features:
-                self.logging.warning(
-                    f"{feature} found in featureSwitch but missing in setFeatures."
-                )
-        await self.session.guest_token()
-        replaced = url.replace("https://api.twitter.com/", "https://twitter.com/i/api/")
-
-        a = await self.session.get(
-            replaced,
-            params={
-                "variables": json.dumps(variables).replace(" ", ""),
-                "features": json.dumps(features).replace(" ", ""),
-            },
-            guest_token=True,
+        a = await self.session.graphql(
+            "UsersByRestIds", variables, self.getUserIdFeatures, rewrite=True
         )
 
-        data: dict = a.json()
+        data: dict = self.session.decode(a)
         inner_data: dict = data.get("data", {})
         if inner_data:
             if len(user_id_str) == 1:
@@ -203,8 +149,6 @@ class TwitterUser:
         :param tweet_id: The tweet ID as an integer. E.G (1564598913784549376).
         :return: a Tweet Object. May return None if the tweet has been deleted or doesn't exist.
         """
-        routes = await self.routes
-
         variables = {
             "focalTweetId": str(tweet_id),
             "with_rux_injections": False,
@@ -221,34 +165,10 @@ class TwitterUser:
             "withV2Timeline": True,
         }
 
-        route = routes.get("TweetDetail")
-        if not route:
-            print("Routes list:")
-            print(routes)
-            raise Exception("Missing routes?")
-        url = route[0]
-
-        # Twitter raises an error if we have a missing feature not present in the list.
-        # We could just look at the defaults but at the same time,
-        # it would be better to not follow blindly.
-        features = self.getTweetFeatures
-        set_features = list(features.keys())
-        for feature in route[1]["featureSwitches"]:
-            if feature not in set_features:
-                self.logging.warning(
-                    f"{feature} found in featureSwitch but missing in setFeatures."
-                )
-        await self.session.ensure_token()
-        replaced = url.replace("https://api.twitter.com/", "https://twitter.com/i/api/")
-        a = await self.session.get(
-            replaced,
-            params={
-                "variables": json.dumps(variables).replace(" ", ""),
-                "features": json.dumps(features).replace(" ", ""),
-            },
-            guest_token=True,
+        a = await self.session.graphql(
+            "TweetDetail", variables, self.getTweetFeatures, rewrite=True
         )
-        data: dict = a.json()
+        data: dict = self.session.decode(a)
         inner_data: dict = data.get("data", {})
         for instruction in inner_data["threaded_conversation_with_injections_v2"].get(
             "instructions"
@@ -1,3 +1,4 @@
+import datetime
 import email.utils
 import re
 import typing
@@ -13,7 +14,36 @@ from . import (
 )
 
 
+# Twitter's snowflake epoch, in milliseconds.
+TWITTER_EPOCH = 1288834974657
+
+
 class UtilBox:
+    @staticmethod
+    def snowflake_time(snowflake: int) -> datetime.datetime:
+        """
+        :param snowflake: A tweet id.
+        :return: When the tweet was created, in UTC.
+        """
+        ms = (snowflake >> 22) + TWITTER_EPOCH
+        return datetime.datetime.fromtimestamp(ms / 1000, tz=datetime.timezone.utc)
+
+    @staticmethod
+    def time_snowflake(date: datetime.datetime) -> int:
+        """
+        :param date: A datetime. Naive datetimes are taken as UTC.
+        :return: The smallest tweet id that could have been created at that time.
+        """
+        if date.tzinfo is None:
+            date = date.replace(tzinfo=datetime.timezone.utc)
+        return max(0, int(date.timestamp() * 1000) - TWITTER_EPOCH) << 22
+
+    @staticmethod
+    def as_snowflake(value: typing.Union[int, datetime.datetime]) -> int:
+        if isinstance(value, datetime.datetime):
+            return UtilBox.time_snowflake(value)
+        return int(value)
+
     @staticmethod
     def make_user(user_data: dict) -> User:
         username = user_data.get("screen_name")
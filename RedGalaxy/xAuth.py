@@ -1,15 +1,13 @@
 import webbrowser
 
-import aiohttp
-
-from . import global_instance, SessionManager, XAuthException
+from . import get_global_instance, SessionManager, XAuthException
 
 
 class xAuth:
-    def __init__(self, username, password, session: SessionManager = global_instance):
+    def __init__(self, username, password, session: SessionManager = None):
         self.username = username
         self.password = password
-        self.session = session
+        self.session = session if session is not None else get_global_instance()
         self.cache = {}
 
     async def retrieve_credentials(self):
@@ -34,6 +32,8 @@ class xAuth:
             "ui_metrics": "",
         }
 
+        import aiohttp  # Not a hard dependency, only needed for logging in.
+
         if self.session.is_bearer:
             raise XAuthException(
                 "Bearer Only token is not allowed. "
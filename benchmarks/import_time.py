@@ -0,0 +1,47 @@
+# import_time.py
+#
+# Measures how long `import RedGalaxy` takes in a fresh interpreter and checks that
+# nothing heavy (the default session, bs4, js2py) is loaded at import time.
+#
+# Usage: python benchmarks/import_time.py [runs]
+
+import statistics
+import subprocess
+import sys
+
+PROBE = """
+import sys, time
+start = time.perf_counter()
+import RedGalaxy
+took = time.perf_counter() - start
+import RedGalaxy.session
+heavy = [mod for mod in ("bs4", "js2py", "lxml") if mod in sys.modules]
+print(took, RedGalaxy.session._global_instance is not None, ",".join(heavy))
+"""
+
+
+def probe():
+    out = subprocess.run(
+        [sys.executable, "-c", PROBE], capture_output=True, text=True, check=True
+    ).stdout.split()
+    took, created, heavy = float(out[0]), out[1] == "True", out[2] if len(out) > 2 else ""
+    return took, created, heavy
+
+
+def main(runs: int = 10):
+    timings = []
+    for _ in range(runs):
+        took, created, heavy = probe()
+        if created:
+            raise SystemExit("global_instance was created at import time.")
+        if heavy:
+            raise SystemExit(f"Heavy modules imported at import time: {heavy}")
+        timings.append(took)
+    print(
+        f"import RedGalaxy: median {statistics.median(timings) * 1000:.1f}ms, "
+        f"min {min(timings) * 1000:.1f}ms over {runs} runs"
+    )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10)
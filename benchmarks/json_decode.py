@@ -0,0 +1,105 @@
+# json_decode.py
+#
+# Compares parse time per page for the json decoders SessionManager.decode can use.
+# Pass recorded SearchTimeline responses, or run without arguments to use a generated page.
+#
+# Usage: python benchmarks/json_decode.py [page.json ...]
+
+import json
+import pathlib
+import sys
+import time
+
+
+def synthetic_page(tweets: int = 20) -> bytes:
+    # Roughly the shape and size of a SearchTimeline page.
+    user = {
+        "rest_id": "783214",
+        "legacy": {
+            "screen_name": "Twitter",
+            "name": "Twitter",
+            "description": "What's happening?! " * 5,
+            "created_at": "Tue Feb 20 14:35:54 +0000 2007",
+            "followers_count": 66000000,
+            "entities": {"description": {"urls": []}, "url": {"urls": []}},
+        },
+    }
+    entries = [
+        {
+            "entryId": f"tweet-{1650000000000000000 + i}",
+            "content": {
+                "__typename": "TimelineTimelineItem",
+                "itemContent": {
+                    "tweet_results": {
+                        "result": {
+                            "core": {"user_results": {"result": user}},
+                            "legacy": {
+                                "id_str": str(1650000000000000000 + i),
+                                "full_text": "Lorem ipsum dolor sit amet " * 10,
+                                "created_at": "Sun Apr 23 10:00:00 +0000 2023",
+                                "entities": {"urls": [], "hashtags": [], "user_mentions": []},
+                                "extended_entities": {"media": []},
+                                "conversation_id_str": str(1650000000000000000 + i),
+                                "reply_count": i,
+                                "retweet_count": i,
+                                "favorite_count": i,
+                                "quote_count": i,
+                                "lang": "en",
+                            },
+                        }
+                    }
+                },
+            },
+        }
+        for i in range(tweets)
+    ]
+    page = {
+        "data": {
+            "search_by_raw_query": {
+                "search_timeline": {
+                    "timeline": {
+                        "instructions": [{"type": "TimelineAddEntries", "entries": entries}]
+                    }
+                }
+            }
+        }
+    }
+    return json.dumps(page).encode()
+
+
+def decoders():
+    # What httpx.Response.json() does: decode to text, then stdlib json.
+    yield "stdlib (text)", lambda data: json.loads(data.decode("utf-8"))
+    yield "stdlib (bytes)", json.loads
+    try:
+        import orjson
+
+        yield "orjson", orjson.loads
+    except ImportError:
+        print("orjson not installed. Skipping.")
+    try:
+        import msgspec
+
+        yield "msgspec", msgspec.json.decode
+    except ImportError:
+        print("msgspec not installed. Skipping.")
+
+
+def main(paths):
+    pages = [pathlib.Path(path).read_bytes() for path in paths] or [synthetic_page()]
+    size = sum(len(page) for page in pages) / len(pages)
+    print(f"{len(pages)} page(s), {size / 1024:.0f}KB on average")
+    runs = 50
+    baseline = None
+    for name, decode in decoders():
+        start = time.perf_counter()
+        for _ in range(runs):
+            for page in pages:
+                decode(page)
+        per_page = (time.perf_counter() - start) / (runs * len(pages))
+        baseline = baseline or per_page
+        print(f"  {name:<15} {per_page * 1000:.3f}ms/page ({baseline / per_page:.1f}x)")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,57 @@
+# route_parse.py
+#
+# Compares the native object literal parser used by HighGravity against the old js2py
+# evaluation on recorded endpoint bundles. js2py is only needed for the comparison.
+#
+# Usage: python benchmarks/route_parse.py bundle.js [bundle.js ...]
+
+import pathlib
+import re
+import sys
+import time
+
+from RedGalaxy.HighGravity import HighGravity
+
+
+def js2py_routes(js: str) -> dict:
+    # The js2py path HighGravity.process_js used before the native parser.
+    import js2py
+
+    reg = re.compile("({)e\\.exports=({+.+?}+)")
+    final_routes = {}
+    for a, b in reg.findall(js):
+        c = js2py.eval_js(f"route = {(a + b)[1:-1]}")
+        url = f"https://api.twitter.com/graphql/{c['queryId']}/{c['operationName']}"
+        final_routes[c["operationName"]] = [url, c["metadata"].to_dict()]
+    return final_routes
+
+
+def timed(func, js: str, runs: int):
+    start = time.perf_counter()
+    for _ in range(runs):
+        result = func(js)
+    return (time.perf_counter() - start) / runs, result
+
+
+def main(paths):
+    for path in paths:
+        js = pathlib.Path(path).read_text(encoding="utf-8")
+        native_time, native = timed(HighGravity.extract_routes, js, 20)
+        print(f"{path}: {len(native)} routes")
+        print(f"  native: {native_time * 1000:.2f}ms")
+        try:
+            import js2py  # noqa: F401
+        except ImportError:
+            print("  js2py not installed. Skipping comparison.")
+            continue
+        js2py_time, old = timed(js2py_routes, js, 1)
+        print(f"  js2py:  {js2py_time * 1000:.2f}ms ({js2py_time / native_time:.0f}x slower)")
+        if old != native:
+            missing = sorted(set(old) ^ set(native))
+            print(f"  !! Outputs differ. Mismatched routes: {missing}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        raise SystemExit("Usage: python benchmarks/route_parse.py bundle.js [bundle.js ...]")
+    main(sys.argv[1:])